@@ -1,9 +1,13 @@
+import os
 import re
+import sys
 import pandas as pd
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
 from langchain_community.embeddings import HuggingFaceEmbeddings
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ts_chunker import SemanticChunker
+
 def embed_texts(texts):
     embed = HuggingFaceEmbeddings(
         model_name="TencentBAC/Conan-embedding-v1",
@@ -67,49 +71,9 @@ try:
                 large_chunks.append([case_id, "", []])
         
         # New sentence-based chunking method (小塊)
-        single_sentences_list = re.split(r'[，。]', case)
-        sentences = [{'sentence': x.strip(), 'index': i} for i, x in enumerate(single_sentences_list) if x.strip()]
-        
-        # Generate embeddings for sentences
-        embeddings = embed_texts([x['sentence'] for x in sentences])
-        for i, sentence in enumerate(sentences):
-            sentence['embedding'] = embeddings[i]
-        
-        # Calculate cosine distances
-        distances = []
-        for i in range(len(sentences) - 1):
-            embedding_current = sentences[i]['embedding']
-            embedding_next = sentences[i + 1]['embedding']
-            similarity = cosine_similarity([embedding_current], [embedding_next])[0][0]
-            distances.append(similarity)
-            sentences[i]['distance_to_next'] = similarity
-        
-        # Calculate threshold and create chunks
-        if distances:
-            sorted_distances = sorted(distances)
-            percentage = 90
-            cutoff_index = int(len(sorted_distances) * (100 - percentage) / 100)
-            threshold = sorted_distances[cutoff_index]
-            
-            # Determine breakpoints
-            indices_above_thresh = [i for i, x in enumerate(distances) if x < threshold]
-            
-            # Create chunks
-            start_index = 0
-            chunks = []
-            
-            # Process breakpoints
-            for index in indices_above_thresh:
-                group = sentences[start_index:index + 1]
-                combined_text = '。'.join([d['sentence'] for d in group]) + '。'
-                chunks.append(combined_text)
-                start_index = index + 1
-            
-            # Add final chunk if needed
-            if start_index < len(sentences):
-                combined_text = '。'.join([d['sentence'] for d in sentences[start_index:]]) + '。'
-                chunks.append(combined_text)
-            
+        chunks = SemanticChunker(embed_texts, percentage=90).split(case)
+
+        if chunks:
             # Generate embeddings for chunks
             chunk_embeddings = embed_texts(chunks)
             
@@ -0,0 +1,83 @@
+import os
+import re
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ts_models import EmbeddingModel
+from ts_chunker import SemanticChunker
+
+# Offline check: compare chunk vectors pooled from sentence embeddings
+# against chunk vectors re-embedded from the chunk text.
+
+def normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+def top_k_cases(query: np.ndarray, corpus: np.ndarray, case_ids: list, k: int) -> list:
+    scores = corpus @ query
+    return [case_ids[i] for i in np.argsort(-scores)[:k]]
+
+def main():
+    model = EmbeddingModel()
+    chunker = SemanticChunker(model.embed_texts, percentage=70, min_chunk_chars=50, max_chunk_chars=230)
+
+    excel_file = input("Enter filename for lawyer_input data (XLSX): ").strip()
+    xl = pd.ExcelFile(excel_file)
+    print("Available sheets:", xl.sheet_names)
+    sheet_name = input("Enter sheet name: ").strip()
+    df = pd.read_excel(excel_file, sheet_name=sheet_name)
+    print("Available columns:", df.columns.tolist())
+    column = input("Enter column name: ").strip()
+    print(f"Available rows: 0 to {len(df)-1}")
+    start_row = int(input("Enter start row: ").strip())
+    end_row = int(input("Enter end row: ").strip())
+    k = int(input("Enter Top-K for retrieval comparison: ").strip())
+
+    queries = []
+    chunk_case_ids = []
+    pooled_vectors = []
+    embedded_vectors = []
+
+    for case_id, text in df[column][start_row:end_row+1].items():
+        # Same preprocessing as LegalRAGSystem.process_lawyer_input
+        truncated_text = re.split(r'[\s\n]三、', text)[0]
+        truncated_text = re.sub(r'\s+', '', truncated_text)
+
+        chunks, pooled = chunker.split_with_embeddings(truncated_text, pool=True)
+        if not chunks:
+            continue
+        embedded = normalize(model.embed_texts(chunks))
+
+        similarities = np.sum(pooled * embedded, axis=1)
+        print(f"Case {case_id}: {len(chunks)} chunks, cosine(pooled, re-embedded) mean={similarities.mean():.4f} min={similarities.min():.4f}")
+
+        queries.append(normalize(model.embed_texts([text]))[0])
+        chunk_case_ids.extend([case_id] * len(chunks))
+        pooled_vectors.append(pooled)
+        embedded_vectors.append(embedded)
+
+    if not queries:
+        print("No chunks produced, nothing to compare")
+        return
+
+    pooled_corpus = np.vstack(pooled_vectors)
+    embedded_corpus = np.vstack(embedded_vectors)
+    all_similarities = np.sum(pooled_corpus * embedded_corpus, axis=1)
+
+    # Retrieval agreement: query with each full text and compare the top-k cases found
+    overlaps = []
+    for query in queries:
+        pooled_top = set(top_k_cases(query, pooled_corpus, chunk_case_ids, k))
+        embedded_top = set(top_k_cases(query, embedded_corpus, chunk_case_ids, k))
+        overlaps.append(len(pooled_top & embedded_top) / max(len(embedded_top), 1))
+
+    print("\n========== Summary ==========")
+    print(f"Chunks compared: {len(all_similarities)}")
+    print(f"Cosine(pooled, re-embedded): mean={all_similarities.mean():.4f} "
+          f"p10={np.percentile(all_similarities, 10):.4f} min={all_similarities.min():.4f}")
+    print(f"Top-{k} case overlap (pooled vs re-embedded): mean={np.mean(overlaps):.4f} min={np.min(overlaps):.4f}")
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,15 @@
+import os
 import re
+import sys
 import torch
 import numpy as np
 import requests
 import pandas as pd
 from typing import List
 from transformers import AutoTokenizer, AutoModel
-from sklearn.metrics.pairwise import cosine_similarity
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ts_chunker import SemanticChunker
 
 class TextChunkClassifier:
     def __init__(self):
@@ -20,49 +24,7 @@ class TextChunkClassifier:
         return outputs.last_hidden_state[:, 0, :].numpy()
 
     def chunk_text(self, text: str, percentage: int = 80) -> List[str]:
-        # Split into sentences
-        sentences = re.split(r'[，。]', text)
-        sentences = [{'sentence': x.strip(), 'index': i} for i, x in enumerate(sentences) if x.strip()]
-        
-        if not sentences:  # Return empty list if no valid sentences
-            return []
-            
-        # Get embeddings
-        embeddings = self.embed_texts([x['sentence'] for x in sentences])
-        
-        # Calculate distances
-        distances = []
-        for i in range(len(sentences) - 1):
-            similarity = cosine_similarity([embeddings[i]], [embeddings[i + 1]])[0][0]
-            distances.append(similarity)
-            sentences[i]['distance_to_next'] = similarity
-
-        # If only one sentence, return it as a single chunk
-        if not distances:
-            return [sentences[0]['sentence'] + '。']
-
-        # Calculate threshold
-        sorted_distances = sorted(distances)
-        cutoff_index = int(len(sorted_distances) * (100 - percentage) / 100)
-        threshold = sorted_distances[cutoff_index]
-        
-        # Find breakpoints
-        indices_above_thresh = [i for i, x in enumerate(distances) if x < threshold]
-        
-        # Create chunks
-        chunks = []
-        start_index = 0
-        for index in indices_above_thresh:
-            group = sentences[start_index:index + 1]
-            combined_text = '。'.join([d['sentence'] for d in group]) + '。'
-            chunks.append(combined_text)
-            start_index = index + 1
-            
-        if start_index < len(sentences):
-            combined_text = '。'.join([d['sentence'] for d in sentences[start_index:]]) + '。'
-            chunks.append(combined_text)
-            
-        return chunks
+        return SemanticChunker(self.embed_texts, percentage=percentage).split(text)
 
     def classify_chunk(self, chunk: str) -> str:
         response = requests.post('http://localhost:11434/api/generate', 
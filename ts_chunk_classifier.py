@@ -0,0 +1,211 @@
+# ts_chunk_classifier.py
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from ts_text_processor import TextProcessor
+
+CHUNK_LABELS = ['fact', 'injuries', 'compensation']
+
+class EmbeddingChunkClassifier:
+    """
+    Nearest-centroid chunk classifier on top of the chunk embeddings.
+
+    Centroids are the normalized mean embedding of each label. The confidence
+    of a prediction is the cosine margin between the best and second best
+    centroid; predictions below the threshold fall back to the LLM classifier.
+    The classifier only routes chunks after its confident predictions reached
+    min_accuracy on held-out labelled chunks; until then every chunk goes to
+    the LLM. Centroids and the validation result can be saved and loaded so
+    they are computed once instead of on every startup.
+    """
+
+    def __init__(self, threshold: float = 0.02, min_accuracy: float = 0.95):
+        """
+        Args:
+            threshold: Minimum cosine margin between the best and second best centroid
+                for a prediction to be used; lower margins go to the LLM
+            min_accuracy: Accuracy the confident predictions must reach on held-out
+                labelled chunks before the classifier routes any chunk
+        """
+        self.threshold = threshold
+        self.min_accuracy = min_accuracy
+        self.labels: List[str] = []
+        self.centroids: Optional[np.ndarray] = None
+        # Result of the last validation; routing stays off unless "validated" is True
+        self.validation = {"accuracy": 0.0, "coverage": 0.0, "samples": 0, "validated": False}
+        self.stats = {"embedding": 0, "llm_fallback": 0}
+        self._stats_lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(matrix: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+    @property
+    def is_fitted(self) -> bool:
+        return self.centroids is not None
+
+    @property
+    def is_routing(self) -> bool:
+        """True when the classifier is fitted and validated at the current threshold"""
+        return self.is_fitted and self.validation["validated"]
+
+    def fit(self, embeddings_by_label: Dict[str, List[List[float]]]):
+        """
+        Compute one centroid per label
+
+        Args:
+            embeddings_by_label: Dictionary mapping label to its training embeddings
+        """
+        labels, centroids = [], []
+        for label, embeddings in embeddings_by_label.items():
+            if not len(embeddings):
+                print(f"警告: 分類器缺少 '{label}' 的訓練資料")
+                continue
+            normalized = self._normalize(np.asarray(embeddings, dtype=np.float32))
+            labels.append(label)
+            centroids.append(self._normalize(normalized.mean(axis=0)))
+
+        # A classifier with fewer than two classes cannot decide anything
+        if len(labels) < 2:
+            self.labels, self.centroids = [], None
+            return
+
+        self.labels = labels
+        self.centroids = np.vstack(centroids)
+
+    def evaluate(self, embeddings_by_label: Dict[str, List[List[float]]]) -> Dict:
+        """
+        Check the confident predictions against labelled embeddings
+
+        Args:
+            embeddings_by_label: Dictionary mapping label to embeddings not used for fitting
+
+        Returns:
+            Dictionary with accuracy (of the predictions at or above the threshold),
+            coverage (share of chunks predicted at or above the threshold), samples
+            and validated (accuracy >= min_accuracy)
+        """
+        total, confident, correct = 0, 0, 0
+        for label, embeddings in embeddings_by_label.items():
+            for embedding in embeddings:
+                predicted, margin = self.predict(embedding)
+                total += 1
+                if predicted is not None and margin >= self.threshold:
+                    confident += 1
+                    correct += predicted == label
+
+        accuracy = correct / confident if confident else 0.0
+        self.validation = {
+            "accuracy": accuracy,
+            "coverage": confident / total if total else 0.0,
+            "samples": total,
+            "validated": confident > 0 and accuracy >= self.min_accuracy
+        }
+        return self.validation
+
+    def fit_from_elasticsearch(self, es_manager, max_docs_per_label: int = 1000, holdout_every: int = 5):
+        """
+        Train from the chunks already labelled and stored in Elasticsearch and
+        validate on a held-out share of them (every holdout_every-th chunk)
+        """
+        train, holdout = {}, {}
+        for label in CHUNK_LABELS:
+            embeddings = es_manager.get_labelled_embeddings(label, max_docs_per_label)
+            train[label] = [e for i, e in enumerate(embeddings) if i % holdout_every]
+            holdout[label] = [e for i, e in enumerate(embeddings) if not i % holdout_every]
+
+        self.fit(train)
+        if not self.is_fitted:
+            print("警告: 訓練資料不足，所有 chunk 將使用 LLM 分類")
+            return
+
+        validation = self.evaluate(holdout)
+        print(f"向量分類器訓練完成，類別: {self.labels}，驗證結果: {validation}")
+        if not validation["validated"]:
+            print(f"警告: 向量分類器在門檻 {self.threshold} 的準確率未達 {self.min_accuracy}，所有 chunk 將使用 LLM 分類")
+
+    def save(self, path: str):
+        """Save the centroids and the validation result"""
+        np.savez(
+            path,
+            labels=np.array(self.labels),
+            centroids=self.centroids,
+            threshold=self.threshold,
+            accuracy=self.validation["accuracy"],
+            coverage=self.validation["coverage"],
+            samples=self.validation["samples"]
+        )
+
+    def load(self, path: str) -> bool:
+        """
+        Load centroids saved by save()
+
+        Returns:
+            False if the file does not exist
+        """
+        if not os.path.exists(path):
+            return False
+
+        with np.load(path) as data:
+            self.labels = [str(label) for label in data["labels"]]
+            self.centroids = data["centroids"].astype(np.float32)
+            self.validation = {
+                "accuracy": float(data["accuracy"]),
+                "coverage": float(data["coverage"]),
+                "samples": int(data["samples"]),
+                "validated": False
+            }
+            saved_threshold = float(data["threshold"])
+
+        # The validation only holds for the threshold it was computed with
+        if saved_threshold != self.threshold:
+            print(f"警告: 向量分類器以門檻 {saved_threshold} 驗證，與目前門檻 {self.threshold} 不同，所有 chunk 將使用 LLM 分類")
+        else:
+            self.validation["validated"] = self.validation["samples"] > 0 and self.validation["accuracy"] >= self.min_accuracy
+        print(f"已載入向量分類器 {path}，類別: {self.labels}，驗證結果: {self.validation}")
+        return True
+
+    def predict(self, embedding) -> Tuple[Optional[str], float]:
+        """
+        Predict the label of one chunk embedding
+
+        Returns:
+            (label, confidence margin), or (None, 0.0) if the classifier is not fitted
+        """
+        if not self.is_fitted:
+            return None, 0.0
+
+        scores = self.centroids @ self._normalize(np.asarray(embedding, dtype=np.float32))
+        order = np.argsort(-scores)
+        margin = float(scores[order[0]] - scores[order[1]])
+        return self.labels[order[0]], margin
+
+    def classify(self, chunk: str, embedding) -> str:
+        """Classify a chunk by its embedding, falling back to the LLM when not confident"""
+        return self.classify_many([chunk], [embedding])[0]
+
+    def classify_many(self, chunks: List[str], embeddings) -> List[str]:
+        """
+        Classify the chunks of a case; chunks below the confidence threshold are
+        sent together to the LLM in one batch call
+        """
+        labels: List[Optional[str]] = [None] * len(chunks)
+        if self.is_routing:
+            for i, embedding in enumerate(embeddings):
+                label, confidence = self.predict(embedding)
+                if label is not None and confidence >= self.threshold:
+                    labels[i] = label
+
+        pending = [i for i, label in enumerate(labels) if label is None]
+        with self._stats_lock:
+            self.stats["embedding"] += len(chunks) - len(pending)
+            self.stats["llm_fallback"] += len(pending)
+
+        if pending:
+            llm_labels = TextProcessor.classify_chunks([chunks[i] for i in pending])
+            for i, label in zip(pending, llm_labels):
+                labels[i] = label
+
+        return labels
@@ -0,0 +1,136 @@
+# ts_chunker.py
+import re
+from typing import Callable, List, Optional, Sequence, Tuple
+import numpy as np
+
+def adjacent_cosine_similarities(embeddings: np.ndarray) -> np.ndarray:
+    """
+    Cosine similarity between each pair of consecutive rows, computed in one pass
+
+    Args:
+        embeddings: Matrix of shape (n, dim)
+
+    Returns:
+        Array of length n - 1 where element i is cos(embeddings[i], embeddings[i + 1])
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if len(embeddings) < 2:
+        return np.zeros(0, dtype=np.float32)
+
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    normalized = embeddings / np.maximum(norms, 1e-12)
+    return np.einsum('ij,ij->i', normalized[:-1], normalized[1:])
+
+
+class SemanticChunker:
+    """
+    Split text into chunks at the points where adjacent sentences are least similar.
+
+    Sentences are split on '，' and '。'. A split happens between sentence i and
+    i + 1 when their similarity falls below the given percentile and the current
+    chunk has at least min_chunk_chars characters. A chunk is also closed before
+    it would exceed max_chunk_chars.
+    """
+
+    def __init__(self, embed_fn: Callable[[List[str]], Sequence], percentage: int = 70,
+                 min_chunk_chars: int = 0, max_chunk_chars: Optional[int] = None):
+        self.embed_fn = embed_fn
+        self.percentage = percentage
+        self.min_chunk_chars = min_chunk_chars
+        self.max_chunk_chars = max_chunk_chars
+
+    @staticmethod
+    def split_sentences(text: str) -> List[str]:
+        return [x.strip() for x in re.split(r'[，。]', text) if x.strip()]
+
+    def split(self, text: str) -> List[str]:
+        chunks, _ = self.split_with_embeddings(text)
+        return chunks
+
+    def split_with_embeddings(self, text: str, pool: bool = False) -> Tuple[List[str], Optional[np.ndarray]]:
+        """
+        Chunk text and optionally derive chunk vectors from the sentence embeddings
+
+        Args:
+            text: Text to chunk
+            pool: If True, also return chunk vectors pooled from the sentence
+                embeddings already computed for finding split points
+
+        Returns:
+            (chunks, pooled chunk embeddings or None)
+        """
+        sentences = self.split_sentences(text)
+        if not sentences:
+            return [], None
+
+        embeddings = np.asarray(self.embed_fn(sentences), dtype=np.float32)
+        spans = self.find_spans(sentences, adjacent_cosine_similarities(embeddings))
+        chunks = ['。'.join(sentences[start:end]) + '。' for start, end in spans]
+
+        if not pool:
+            return chunks, None
+        return chunks, pool_span_embeddings(sentences, embeddings, spans)
+
+    def find_spans(self, sentences: List[str], similarities: np.ndarray) -> List[Tuple[int, int]]:
+        if len(similarities) == 0:
+            return [(0, len(sentences))]
+
+        sorted_similarities = np.sort(similarities)
+        cutoff_index = int(len(sorted_similarities) * (100 - self.percentage) / 100)
+        threshold = sorted_similarities[cutoff_index]
+
+        spans = []
+        start_index = 0
+        current_chars = 0
+
+        for i in range(len(sentences)):
+            sentence_chars = len(sentences[i])
+
+            # If adding this sentence would exceed max_chunk_chars, split here
+            if (self.max_chunk_chars is not None and i > start_index
+                    and current_chars + sentence_chars > self.max_chunk_chars):
+                spans.append((start_index, i))
+                start_index = i
+                current_chars = sentence_chars
+            else:
+                current_chars += sentence_chars
+
+            # If this is a semantic split point and we have at least min_chunk_chars
+            if i < len(similarities) and similarities[i] < threshold and current_chars >= self.min_chunk_chars:
+                spans.append((start_index, i + 1))
+                start_index = i + 1
+                current_chars = 0
+
+        # Add the last chunk if there's anything left
+        if start_index < len(sentences):
+            spans.append((start_index, len(sentences)))
+
+        return spans
+
+
+def pool_span_embeddings(sentences: List[str], embeddings: np.ndarray, spans: List[Tuple[int, int]]) -> np.ndarray:
+    """
+    Build chunk vectors from sentence vectors instead of embedding each chunk again
+
+    Each chunk vector is the mean of its sentence vectors weighted by sentence
+    length (in characters), renormalized to unit length.
+
+    Args:
+        sentences: Sentences of the text
+        embeddings: Sentence embeddings, one row per sentence
+        spans: (start, end) sentence span of each chunk
+
+    Returns:
+        Matrix of shape (len(spans), dim)
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    normalized = embeddings / np.maximum(norms, 1e-12)
+    weights = np.array([len(sentence) for sentence in sentences], dtype=np.float32)
+
+    pooled = np.zeros((len(spans), embeddings.shape[1]), dtype=np.float32)
+    for i, (start, end) in enumerate(spans):
+        pooled[i] = weights[start:end] @ normalized[start:end]
+
+    pooled_norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+    return pooled / np.maximum(pooled_norms, 1e-12)
@@ -32,8 +32,8 @@ class RetrievalSystem:
         print("成功連接 Elasticsearch 和初始化 Embedding 模型")
     
     def close(self):
-        """Close connections - no connections to close in this simplified version"""
-        pass
+        """Close the embedding cache connection"""
+        self.embedding_model.close()
     
     def search_elasticsearch(self, query_text: str, search_type: str, k: int) -> List[Dict]:
         """
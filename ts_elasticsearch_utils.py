@@ -1,9 +1,42 @@
 # ts_elasticsearch_utils.py
+import threading
 from elasticsearch import Elasticsearch
-from typing import List
+from elasticsearch.helpers import streaming_bulk
+from typing import List, Dict, Optional
+
+def check_embedding_mapping(es: Elasticsearch, index_name: str, dims: Optional[int] = None) -> bool:
+    """
+    Check the embedding mapping of an existing index
+
+    Args:
+        es: Elasticsearch client
+        index_name: Index to check
+        dims: Expected vector dimension; not checked when None
+
+    Returns:
+        True if the embedding field has an HNSW index, so approximate kNN search can be used
+
+    Raises:
+        ValueError: If the index has no embedding field or its dims differ from dims
+    """
+    current_mapping = es.indices.get_mapping(index=index_name)
+    embedding = current_mapping[index_name]['mappings'].get('properties', {}).get('embedding')
+    if embedding is None:
+        raise ValueError(f"索引 {index_name} 沒有 embedding 欄位")
+
+    current_dims = embedding.get('dims')
+    if dims is not None and current_dims != dims:
+        raise ValueError(f"現有索引的維度 ({current_dims}) 與當前模型的維度 ({dims}) 不匹配")
+
+    if not embedding.get('index', False):
+        print(f"警告: 索引 {index_name} 的 embedding 欄位沒有 HNSW 索引，只能使用精確搜索；"
+              "需要以新的 mapping 重建索引才能使用 kNN 搜索")
+        return False
+    return True
 
 class ElasticsearchManager:
-    def __init__(self, host: str, username: str, password: str):
+    def __init__(self, host: str, username: str, password: str, bulk: bool = False,
+                 bulk_flush_docs: int = 500, bulk_flush_bytes: int = 50 * 1024 * 1024):
         self.es = Elasticsearch(
             host,
             http_auth=(username, password),
@@ -11,8 +44,22 @@ class ElasticsearchManager:
         )
         self.index_name = 'ts_text_embeddings'
 
+        # Buffered bulk writer: store_embedding queues documents and flush() sends them
+        # with streaming_bulk once bulk_flush_docs documents or bulk_flush_bytes are pending
+        self.bulk = bulk
+        self.bulk_flush_docs = bulk_flush_docs
+        self.bulk_flush_bytes = bulk_flush_bytes
+        self.bulk_errors: List[Dict] = []
+        self._bulk_buffer: List[Dict] = []
+        self._bulk_buffer_bytes = 0
+        self._bulk_lock = threading.Lock()
+        # Serializes flushes, so once flush() returns every document queued before it was sent
+        self._flush_lock = threading.Lock()
+
     def setup_indices(self, dims: int):
-        """Set up a single index with type tagging and chunk ID"""
+        """Set up a single index with type tagging and chunk ID.
+        Creates the index with the HNSW mapping when it does not exist; an existing
+        index is kept and its embedding mapping is checked (ValueError on a dims mismatch)."""
         mapping = {
             "mappings": {
                 "properties": {
@@ -23,7 +70,15 @@ class ElasticsearchManager:
                     "case_type": {"type": "keyword"},  # Add case_type field
                     "embedding": {
                         "type": "dense_vector",
-                        "dims": dims
+                        "dims": dims,
+                        # HNSW graph for approximate kNN search
+                        "index": True,
+                        "similarity": "cosine",
+                        "index_options": {
+                            "type": "hnsw",
+                            "m": 16,
+                            "ef_construction": 100
+                        }
                     }
                 }
             },
@@ -32,24 +87,13 @@ class ElasticsearchManager:
             }
         }
 
-        """if self.es.indices.exists(index=self.index_name):
-            print(f"\n發現現有索引 {self.index_name}")
-            choice = input("是否要刪除現有索引？(yes/no): ").strip().lower()
-            
-            if choice == 'yes':
-                print(f"刪除現有索引 {self.index_name}")
-                self.es.indices.delete(index=self.index_name)
-                print(f"創建新索引 {self.index_name}")
-                self.es.indices.create(index=self.index_name, body=mapping)
-            else:
-                print("保留現有索引")
-                current_mapping = self.es.indices.get_mapping(index=self.index_name)
-                current_dims = current_mapping[self.index_name]['mappings']['properties']['embedding']['dims']
-                if current_dims != dims:
-                    raise ValueError(f"現有索引的維度 ({current_dims}) 與當前模型的維度 ({dims}) 不匹配")
-        else:
+        if not self.es.indices.exists(index=self.index_name):
             print(f"創建新索引 {self.index_name}")
-            self.es.indices.create(index=self.index_name, body=mapping)"""
+            self.es.indices.create(index=self.index_name, body=mapping)
+            return
+
+        print(f"使用現有索引 {self.index_name}")
+        check_embedding_mapping(self.es, self.index_name, dims)
 
     # Add case_type parameter to store_embedding method
     def store_embedding(self, text_type: str, case_id: int, chunk_id: str, text: str, embedding: List[float], case_type: str = ""):
@@ -65,6 +109,10 @@ class ElasticsearchManager:
                 "case_type": case_type  # Add case_type field
             }
 
+            if self.bulk:
+                self._queue_bulk(chunk_id, doc)
+                return
+
             # Index the document
             self.es.index(index=self.index_name, id=chunk_id, body=doc)
             print(f"存儲文本嵌入成功：{chunk_id}")
@@ -73,6 +121,75 @@ class ElasticsearchManager:
             print(f"存儲嵌入時發生錯誤：{str(e)}")
             raise
 
+    def _queue_bulk(self, chunk_id: str, doc: Dict):
+        # Rough size of the serialized action: vector floats dominate the payload
+        doc_bytes = len(doc["text"].encode('utf-8')) + len(doc["embedding"]) * 20 + 200
+        with self._bulk_lock:
+            self._bulk_buffer.append({
+                "_op_type": "index",
+                "_index": self.index_name,
+                "_id": chunk_id,
+                "_source": doc
+            })
+            self._bulk_buffer_bytes += doc_bytes
+            should_flush = (len(self._bulk_buffer) >= self.bulk_flush_docs
+                            or self._bulk_buffer_bytes >= self.bulk_flush_bytes)
+        if should_flush:
+            self.flush()
+
+    def flush(self) -> List[Dict]:
+        """
+        Send all buffered documents with the bulk API
+
+        Returns:
+            List of per-item errors of this flush (empty if everything was indexed)
+        """
+        with self._flush_lock:
+            with self._bulk_lock:
+                actions = self._bulk_buffer
+                self._bulk_buffer = []
+                self._bulk_buffer_bytes = 0
+
+            if not actions:
+                return []
+
+            errors = []
+            indexed = 0
+            try:
+                for ok, item in streaming_bulk(
+                        self.es,
+                        actions,
+                        chunk_size=self.bulk_flush_docs,
+                        max_chunk_bytes=self.bulk_flush_bytes,
+                        raise_on_error=False,
+                        raise_on_exception=False):
+                    if ok:
+                        indexed += 1
+                    else:
+                        errors.append(item)
+                        result = item.get("index", item)
+                        print(f"存儲嵌入時發生錯誤：{result.get('_id')} {result.get('error')}")
+            except Exception as e:
+                print(f"批次存儲嵌入時發生錯誤：{str(e)}")
+                # Nothing of this flush is known to be stored; report every document as failed
+                with self._bulk_lock:
+                    self.bulk_errors.extend(
+                        {"index": {"_id": action["_id"], "error": str(e)}} for action in actions
+                    )
+                raise
+
+            print(f"批次存儲文本嵌入完成：成功 {indexed} 筆，失敗 {len(errors)} 筆")
+            with self._bulk_lock:
+                self.bulk_errors.extend(errors)
+            return errors
+
+    def close(self):
+        """Flush pending bulk documents and close the connection"""
+        try:
+            self.flush()
+        finally:
+            self.es.close()
+
     def get_max_case_id(self) -> int:
         """Retrieve the maximum case_id from Elasticsearch"""
         try:
@@ -96,27 +213,18 @@ class ElasticsearchManager:
             print(f"Error retrieving max case_id from Elasticsearch: {str(e)}")
             return -1
 
-    def get_chunk_count(self, case_id: int, chunk_type: str) -> int:
-        """Get the count of chunks for a specific case_id and chunk_type
-        with a forced refresh to ensure accuracy"""
+    def get_labelled_embeddings(self, text_type: str, max_docs: int = 1000) -> List[List[float]]:
+        """Get stored embeddings of a given text_type, used to train the chunk classifier"""
         try:
-            # Force a refresh to make sure all documents are searchable
-            self.es.indices.refresh(index=self.index_name)
-            
-            # Query with both case_id and text_type filters
-            query = {
-                "query": {
-                    "bool": {
-                        "must": [
-                            {"term": {"case_id": case_id}},
-                            {"term": {"text_type": chunk_type}}
-                        ]
-                    }
+            response = self.es.search(
+                index=self.index_name,
+                body={
+                    "size": max_docs,
+                    "query": {"term": {"text_type": text_type}},
+                    "_source": ["embedding"]
                 }
-            }
-            
-            result = self.es.count(index=self.index_name, body=query)
-            return result['count']
+            )
+            return [hit["_source"]["embedding"] for hit in response["hits"]["hits"]]
         except Exception as e:
-            print(f"Error getting chunk count: {str(e)}")
-            return 0  # Return 0 on error to be safe
\ No newline at end of file
+            print(f"Error getting labelled embeddings for {text_type}: {str(e)}")
+            return []
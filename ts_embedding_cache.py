@@ -0,0 +1,139 @@
+# ts_embedding_cache.py
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List
+import numpy as np
+
+# Bump when the meaning of stored vectors changes; entries under older keys are never read again
+# and age out through the LRU eviction
+CACHE_VERSION = 2
+
+class EmbeddingCache:
+    """
+    Persistent content-addressed cache for embedding vectors.
+
+    Vectors are stored as raw float32 blobs in a single SQLite file, keyed by
+    sha256(cache version + model name + variant + text). The variant separates
+    vectors that differ for the same text, e.g. the L2-normalized /api/embed
+    output and the raw /api/embeddings output. When the number of entries
+    exceeds max_entries the least recently used entries are evicted.
+    """
+
+    def __init__(self, path: str, max_entries: int = 200000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                dim INTEGER NOT NULL,
+                vector BLOB NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON embeddings(last_access)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model_name: str, text: str, variant: str = "") -> str:
+        return hashlib.sha256(f"{CACHE_VERSION}\0{model_name}\0{variant}\0{text}".encode('utf-8')).hexdigest()
+
+    def get_many(self, model_name: str, texts: List[str], variant: str = "") -> Dict[int, np.ndarray]:
+        """
+        Look up cached vectors for the given texts
+
+        Args:
+            model_name: Embedding model name
+            texts: Texts to look up
+            variant: How the vectors were produced (endpoint / normalization)
+
+        Returns:
+            Dictionary mapping position in texts to its cached float32 vector
+        """
+        keys = [self.make_key(model_name, text, variant) for text in texts]
+        found = {}
+
+        with self._lock:
+            rows = {}
+            # SQLite limits the number of bound parameters per statement
+            for start in range(0, len(keys), 500):
+                part = list(set(keys[start:start + 500]))
+                placeholders = ",".join("?" * len(part))
+                for key, dim, blob in self._conn.execute(
+                        f"SELECT key, dim, vector FROM embeddings WHERE key IN ({placeholders})", part):
+                    rows[key] = np.frombuffer(blob, dtype=np.float32, count=dim)
+
+            for i, key in enumerate(keys):
+                if key in rows:
+                    found[i] = rows[key]
+
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+
+            if rows:
+                now = time.time()
+                try:
+                    self._conn.executemany(
+                        "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                        [(now, key) for key in rows])
+                    self._conn.commit()
+                except sqlite3.Error:
+                    # Only the LRU order is lost (e.g. the database is locked by another process)
+                    self._conn.rollback()
+
+        return found
+
+    def put_many(self, model_name: str, texts: List[str], vectors: np.ndarray, variant: str = ""):
+        """Store vectors for the given texts and evict least recently used entries if needed"""
+        now = time.time()
+        records = []
+        for text, vector in zip(texts, vectors):
+            vector = np.asarray(vector, dtype=np.float32)
+            records.append((self.make_key(model_name, text, variant), vector.shape[0], vector.tobytes(), now))
+
+        with self._lock:
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, dim, vector, last_access) VALUES (?, ?, ?, ?)",
+                    records)
+                self._evict()
+                self._conn.commit()
+            except sqlite3.Error:
+                # Do not leave a half-written transaction open on the shared connection
+                self._conn.rollback()
+                raise
+
+    def _evict(self):
+        count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute("""
+                DELETE FROM embeddings WHERE key IN (
+                    SELECT key FROM embeddings ORDER BY last_access ASC LIMIT ?
+                )
+                """, (overflow,))
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": entries
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
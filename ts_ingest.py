@@ -0,0 +1,339 @@
+# ts_ingest.py
+# Non-interactive batch ingestion, e.g.
+#   python ts_ingest.py lawyer_input --file data.xlsx --sheet Sheet1 --column 律師輸入 --start-row 0 --end-row 999 --workers 4
+#   python ts_ingest.py indictment --file data.xlsx --sheet Sheet1 --column 起訴狀 --start-row 0 --end-row 999 \
+#       --laws-file laws.xlsx --laws-sheet Sheet1 --laws-column 法條
+# Progress is written to a journal next to the input file; rerun the same command with --resume
+# after an interruption to continue where it stopped.
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Set, Tuple
+import pandas as pd
+from ts_main import LegalRAGSystem
+from ts_text_processor import TextProcessor
+from ts_neo4j_manager import IndictmentFormatError
+from ts_ingest_journal import IngestJournal
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Batch ingestion of lawyer_input / indictment data")
+    parser.add_argument("mode", choices=["lawyer_input", "indictment"],
+                        help="lawyer_input is stored in Elasticsearch, indictment in Neo4j")
+    parser.add_argument("--file", required=True, help="XLSX file with the case texts")
+    parser.add_argument("--sheet", required=True, help="Sheet name")
+    parser.add_argument("--column", required=True, help="Column with the case texts")
+    parser.add_argument("--start-row", type=int, required=True)
+    parser.add_argument("--end-row", type=int, required=True, help="Last row to ingest (inclusive)")
+    parser.add_argument("--start-case-id", type=int, default=None,
+                        help="First case_id to assign (default: max case_id in the target store + 1)")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="Cases (or indictment batches) processed at the same time; each case sends "
+                             "up to OLLAMA_NUM_PARALLEL embedding requests, keep the product within OLLAMA_POOL_SIZE")
+    parser.add_argument("--batch-size", type=int, default=200,
+                        help="Indictments written to Neo4j per batch")
+    parser.add_argument("--flush-every", type=int, default=50,
+                        help="lawyer_input cases between Elasticsearch flushes that mark them as indexed")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue an interrupted run: skip completed rows and reuse journaled results")
+    parser.add_argument("--journal", help="Journal file (default: <file>.<sheet>.<column>.<mode>.journal.jsonl)")
+    parser.add_argument("--rejects", help="Reject file (default: <file>.<sheet>.<column>.<mode>.rejects.jsonl)")
+    parser.add_argument("--laws-file", help="XLSX file with the used laws of each indictment")
+    parser.add_argument("--laws-sheet", help="Sheet name of the used laws")
+    parser.add_argument("--laws-column", help="Column with the used laws")
+    parser.add_argument("--laws-start-row", type=int, default=None, help="Default: --start-row")
+    parser.add_argument("--laws-end-row", type=int, default=None, help="Default: --end-row")
+    return parser.parse_args(argv)
+
+def load_column(file: str, sheet: str, column: str, start_row: int, end_row: int) -> pd.Series:
+    df = pd.read_excel(file, sheet_name=sheet)
+    if column not in df.columns:
+        print(f"錯誤: 工作表 {sheet} 中沒有欄位 {column}，可用欄位: {df.columns.tolist()}")
+        raise KeyError(column)
+    return df[column][start_row:end_row+1]
+
+def is_valid_text(text) -> bool:
+    return isinstance(text, str) and bool(text.strip())
+
+def process_lawyer_row(system: LegalRAGSystem, journal: IngestJournal, row: int, case_id: int, text) -> bool:
+    """
+    Run the stages of one lawyer_input row that are not journaled yet and queue it for indexing
+
+    Returns:
+        False if the row was rejected
+    """
+    if not is_valid_text(text):
+        journal.reject(row, case_id, text, "空白或非文字內容")
+        return False
+
+    data = journal.data(row)
+    if journal.reached(row, "parsed"):
+        # get_case_type returns a tuple, which the JSON journal stores as a list
+        case_type = data["case_type"]
+        if isinstance(case_type, list):
+            case_type = tuple(case_type)
+    else:
+        case_type = system.classify_lawyer_input(text, case_id)
+        journal.record(row, case_id, "parsed", case_type=case_type)
+
+    # Embeddings are not journaled; they come back from the embedding cache
+    chunk_types = data.get("chunk_types") if journal.reached(row, "embedded") else None
+    embedded = system.embed_lawyer_input(text, chunk_types)
+    if chunk_types is None:
+        journal.record(row, case_id, "embedded", chunks=embedded["chunks"], chunk_types=embedded["chunk_types"])
+
+    # Chunk ids are deterministic, so re-indexing a row overwrites its documents
+    system.index_lawyer_input(text, case_id, case_type, embedded)
+    return True
+
+def checkpoint_lawyer_inputs(system: LegalRAGSystem, journal: IngestJournal, queued: Dict[int, int],
+                             index_failed: Set[int], seen_errors: int) -> int:
+    """
+    Flush Elasticsearch and mark the queued rows as indexed
+
+    Args:
+        queued: case_id -> row of the cases queued since the last checkpoint
+        index_failed: case_ids with documents that failed to index so far in this run, updated in place.
+            Worker threads trigger size-based flushes at any time, so a case can fail in an earlier
+            flush than its own checkpoint; the set is kept for the whole run
+        seen_errors: Number of bulk errors already added to index_failed
+
+    Returns:
+        New number of bulk errors added to index_failed
+    """
+    try:
+        system.es_manager.flush()
+    except Exception:
+        index_failed.update(queued)
+
+    bulk_errors = system.es_manager.bulk_errors
+    for item in bulk_errors[seen_errors:]:
+        doc_id = str(item.get("index", item).get("_id", ""))
+        if doc_id.split('-')[0].isdigit():
+            index_failed.add(int(doc_id.split('-')[0]))
+
+    for case_id, row in queued.items():
+        if case_id not in index_failed:
+            journal.record(row, case_id, "indexed")
+    return len(bulk_errors)
+
+def ingest_lawyer_inputs(system: LegalRAGSystem, journal: IngestJournal, rows: Dict[int, int], texts: pd.Series,
+                         workers: int, flush_every: int) -> Tuple[List[int], List[int]]:
+    """
+    Process lawyer_input rows on a worker pool
+
+    Args:
+        rows: row -> case_id of the rows to process
+
+    Returns:
+        (failed case_ids, rejected case_ids)
+    """
+    failed, rejected = [], []
+    queued: Dict[int, int] = {}
+    index_failed: Set[int] = set()
+    seen_errors = len(system.es_manager.bulk_errors)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(process_lawyer_row, system, journal, row, case_id, texts[row]): row
+            for row, case_id in rows.items()
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            row = futures[future]
+            case_id = rows[row]
+            try:
+                if future.result():
+                    queued[case_id] = row
+                    print(f"[{done}/{len(futures)}] lawyer_input 案件 {case_id} 完成")
+                else:
+                    rejected.append(case_id)
+            except Exception as e:
+                print(f"處理 lawyer_input 案件 {case_id} 時發生錯誤: {str(e)}")
+                failed.append(case_id)
+
+            if len(queued) >= flush_every:
+                seen_errors = checkpoint_lawyer_inputs(system, journal, queued, index_failed, seen_errors)
+                queued = {}
+
+    checkpoint_lawyer_inputs(system, journal, queued, index_failed, seen_errors)
+    failed.extend(index_failed & set(rows.values()))
+    return sorted(set(failed)), sorted(rejected)
+
+def ingest_indictments(system: LegalRAGSystem, journal: IngestJournal, rows: Dict[int, int], texts: pd.Series,
+                       workers: int, batch_size: int) -> Tuple[List[int], List[int]]:
+    """
+    Split indictments, then write them to Neo4j in batches, several batches at a time
+
+    Args:
+        rows: row -> case_id of the rows to process
+
+    Returns:
+        (failed case_ids, rejected case_ids)
+    """
+    parsed, rejected = [], []
+    for row, case_id in rows.items():
+        text = texts[row]
+        if journal.reached(row, "parsed"):
+            sections = journal.data(row)["sections"]
+        elif not is_valid_text(text):
+            journal.reject(row, case_id, text, "空白或非文字內容")
+            rejected.append(case_id)
+            continue
+        else:
+            try:
+                sections = system.neo4j_manager.split_indictment(case_id, text)
+            except IndictmentFormatError as e:
+                journal.reject(row, case_id, text, str(e))
+                rejected.append(case_id)
+                continue
+            journal.record(row, case_id, "parsed", sections=sections)
+        parsed.append({"row": row, "case_id": case_id, "case_text": text, **sections})
+
+    def write_batch(batch: List[Dict]):
+        system.neo4j_manager.write_indictment_sections_batch(
+            [{key: value for key, value in item.items() if key != "row"} for item in batch], batch_size
+        )
+        for item in batch:
+            journal.record(item["row"], item["case_id"], "graphed")
+
+    batches = [parsed[start:start + batch_size] for start in range(0, len(parsed), batch_size)]
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(write_batch, batch): batch for batch in batches}
+        for future in as_completed(futures):
+            batch = futures[future]
+            try:
+                future.result()
+                print(f"indictment 案件 {batch[0]['case_id']} 至 {batch[-1]['case_id']} 完成")
+            except Exception as e:
+                print(f"寫入 indictment 案件 {batch[0]['case_id']} 至 {batch[-1]['case_id']} 時發生錯誤: {str(e)}")
+                failed.extend(item["case_id"] for item in batch)
+    return sorted(failed), sorted(rejected)
+
+def link_used_laws(system: LegalRAGSystem, journal: IngestJournal, used_laws: pd.Series, first_case_id: int,
+                   start_case_id: int, start_row: int) -> Tuple[List[int], List[int]]:
+    """
+    Validate the used-law cells and write the law relationships of the graphed indictments
+
+    Args:
+        used_laws: Used-law cells, the first one belonging to first_case_id
+        start_case_id: case_id of start_row, to find the journal row of each case_id
+
+    Returns:
+        (failed case_ids, rejected case_ids)
+    """
+    pending, rejected = {}, []
+    for i, used_laws_str in enumerate(used_laws):
+        case_id = first_case_id + i
+        row = start_row + (case_id - start_case_id)
+        # Only indictments in the graph get relationships; rows already linked or rejected are skipped.
+        # A rejected used-law cell is checked again on --resume, in case it was corrected
+        if journal.status(row) not in ("graphed", "laws_rejected"):
+            continue
+        if not is_valid_text(used_laws_str):
+            journal.reject(row, case_id, used_laws_str, "法條欄位空白或非文字內容", status="laws_rejected")
+            rejected.append(case_id)
+        elif not TextProcessor.extract_law_numbers(used_laws_str):
+            journal.reject(row, case_id, used_laws_str, "法條欄位沒有有效的法條", status="laws_rejected")
+            rejected.append(case_id)
+        else:
+            pending[case_id] = (row, used_laws_str)
+
+    if not pending:
+        return [], rejected
+
+    try:
+        # Relationships are merged, so writing them again after a failure is harmless
+        system.process_used_laws_many({case_id: text for case_id, (_, text) in pending.items()})
+    except Exception as e:
+        print(f"寫入法條關聯時發生錯誤: {str(e)}")
+        return sorted(pending), rejected
+
+    for case_id, (row, _) in pending.items():
+        journal.record(row, case_id, "laws")
+    return [], rejected
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    if args.workers < 1 or args.batch_size < 1 or args.flush_every < 1:
+        print("錯誤: --workers、--batch-size 與 --flush-every 必須大於 0")
+        raise ValueError("workers, batch_size and flush_every must be positive")
+
+    prefix = f"{os.path.splitext(args.file)[0]}.{args.sheet}.{args.column}.{args.mode}"
+    journal_path = args.journal or f"{prefix}.journal.jsonl"
+    reject_path = args.rejects or f"{prefix}.rejects.jsonl"
+    if os.path.exists(journal_path) and not args.resume:
+        print(f"錯誤: 日誌 {journal_path} 已存在，請使用 --resume 續傳，或刪除日誌後重新開始")
+        raise FileExistsError(journal_path)
+
+    texts = load_column(args.file, args.sheet, args.column, args.start_row, args.end_row)
+    print(f"讀取 {len(texts)} 筆 {args.mode} 資料")
+
+    journal = IngestJournal(journal_path, reject_path)
+    system = LegalRAGSystem()
+    try:
+        if journal.run is not None:
+            start_case_id, start_row = journal.run["start_case_id"], journal.run["start_row"]
+            print(f"從日誌 {journal_path} 續傳")
+        else:
+            if args.start_case_id is not None:
+                start_case_id = args.start_case_id
+            elif args.mode == "lawyer_input":
+                start_case_id = system.es_manager.get_max_case_id() + 1
+            else:
+                start_case_id = system.neo4j_manager.get_max_case_id() + 1
+            start_row = args.start_row
+            journal.start(mode=args.mode, file=args.file, sheet=args.sheet, column=args.column,
+                          start_row=start_row, start_case_id=start_case_id)
+        print(f"{args.mode} 將從 case_id {start_case_id} 開始編號")
+
+        # case_id follows the row, so a resumed row keeps the case_id of the first run
+        final_stage = "indexed" if args.mode == "lawyer_input" else "graphed"
+        rows, skipped = {}, 0
+        for row in map(int, texts.index):
+            if journal.reached(row, final_stage) or journal.status(row) == "rejected":
+                skipped += 1
+                continue
+            rows[row] = start_case_id + (row - start_row)
+        if skipped:
+            print(f"略過日誌中已完成或已拒絕的 {skipped} 筆")
+
+        laws_rejected = []
+        if args.mode == "lawyer_input":
+            failed, rejected = ingest_lawyer_inputs(system, journal, rows, texts, args.workers, args.flush_every)
+        else:
+            failed, rejected = ingest_indictments(system, journal, rows, texts, args.workers, args.batch_size)
+
+            if args.laws_file:
+                laws_start_row = args.start_row if args.laws_start_row is None else args.laws_start_row
+                laws_end_row = args.end_row if args.laws_end_row is None else args.laws_end_row
+                used_laws = load_column(args.laws_file, args.laws_sheet, args.laws_column, laws_start_row, laws_end_row)
+                first_case_id = start_case_id + (args.start_row - start_row)
+                laws_failed, laws_rejected = link_used_laws(system, journal, used_laws, first_case_id,
+                                                            start_case_id, start_row)
+                print(f"法條關聯: 失敗 {len(laws_failed)} 筆，拒絕 {len(laws_rejected)} 筆")
+                if laws_failed:
+                    print(f"法條關聯失敗的 case_id: {laws_failed}（可使用 --resume 重試）")
+
+        print(f"\n完成 {len(rows) - len(failed) - len(rejected)}/{len(rows)} 筆，"
+              f"失敗 {len(failed)} 筆，拒絕 {len(rejected)} 筆")
+        if failed:
+            print(f"失敗的 case_id: {failed}（可使用 --resume 重試）")
+        if rejected or laws_rejected:
+            print(f"拒絕的資料已寫入: {reject_path}")
+    finally:
+        try:
+            system.close()
+        finally:
+            journal.close()
+
+if __name__ == "__main__":
+    start_time = time.time()
+    main()
+    elapsed_time = time.time() - start_time
+
+    hours = int(elapsed_time // 3600)
+    minutes = int((elapsed_time % 3600) // 60)
+    seconds = int(elapsed_time % 60)
+
+    print(f"\nTotal execution time: {hours}h {minutes}m {seconds}s")
@@ -0,0 +1,117 @@
+# ts_ingest_journal.py
+import json
+import os
+import threading
+from datetime import datetime
+from typing import Dict, Optional
+
+# Stages a row passes through, in order; "laws" means the used-law relationships of a graphed indictment exist
+STAGES = ["parsed", "embedded", "indexed", "graphed", "laws"]
+
+class IngestJournal:
+    """
+    Append-only JSONL journal of batch ingestion progress.
+
+    Every stage a row completes is appended as one line together with the
+    intermediate results of that stage, so an interrupted run can skip what
+    is done and continue from the last completed stage of each row. Rows that
+    cannot be processed are written to a separate reject file.
+    """
+
+    def __init__(self, path: str, reject_path: str):
+        self.path = path
+        self.reject_path = reject_path
+        self.run: Optional[Dict] = None
+        self._rows: Dict[int, Dict] = {}
+        self._lock = threading.Lock()
+
+        if os.path.exists(path):
+            self._load()
+        self._file = open(path, 'a', encoding='utf-8')
+        self._reject_file = None
+
+    def _load(self):
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A line cut off by a crash; that stage is simply redone
+                    continue
+
+                if entry.get("event") == "start":
+                    if self.run is None:
+                        self.run = entry
+                    continue
+
+                state = self._rows.setdefault(entry["row"], {"case_id": entry["case_id"], "status": None, "data": {}})
+                state["status"] = entry["status"]
+                state["data"].update(entry.get("data", {}))
+
+    @staticmethod
+    def _write(f, entry: Dict):
+        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+    def start(self, **info) -> Dict:
+        """Record the settings of a new run; a resumed run keeps the settings of the first one"""
+        with self._lock:
+            if self.run is None:
+                self.run = {"event": "start", "time": datetime.now().isoformat(), **info}
+                self._write(self._file, self.run)
+            return self.run
+
+    def record(self, row: int, case_id: int, status: str, **data):
+        """Append that a row reached a stage, with the intermediate results to keep"""
+        entry = {"row": row, "case_id": case_id, "status": status, "time": datetime.now().isoformat()}
+        if data:
+            entry["data"] = data
+        with self._lock:
+            self._write(self._file, entry)
+            state = self._rows.setdefault(row, {"case_id": case_id, "status": None, "data": {}})
+            state["status"] = status
+            state["data"].update(data)
+
+    def reject(self, row: int, case_id: int, text, reason: str, status: str = "rejected"):
+        """
+        Write a row that cannot be processed to the reject file
+
+        Args:
+            status: Journal status of the row; "laws_rejected" keeps an indictment that is
+                already in the graph (only its used-law cell was rejected) at the graphed stage
+        """
+        print(f"警告: 第 {row} 列 (case_id: {case_id}) 已寫入拒絕檔: {reason}")
+        with self._lock:
+            if self._reject_file is None:
+                self._reject_file = open(self.reject_path, 'a', encoding='utf-8')
+            self._write(self._reject_file, {
+                "row": row,
+                "case_id": case_id,
+                "status": status,
+                "reason": reason,
+                "text": text if isinstance(text, str) else str(text),
+                "time": datetime.now().isoformat()
+            })
+        self.record(row, case_id, status, reason=reason)
+
+    def status(self, row: int) -> Optional[str]:
+        state = self._rows.get(row)
+        return state["status"] if state else None
+
+    def data(self, row: int) -> Dict:
+        state = self._rows.get(row)
+        return dict(state["data"]) if state else {}
+
+    def reached(self, row: int, stage: str) -> bool:
+        """Whether the row completed the given stage (rejected rows never do)"""
+        status = self.status(row)
+        if status == "laws_rejected":
+            status = "graphed"
+        return status in STAGES and STAGES.index(status) >= STAGES.index(stage)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+            if self._reject_file is not None:
+                self._reject_file.close()
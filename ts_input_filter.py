@@ -1,137 +1,140 @@
 #ts_input_filter.py
-from langchain.chains import LLMChain
-from langchain.prompts import PromptTemplate
-from langchain_ollama import OllamaLLM
+import json
+import os
 import re
+import threading
+from typing import Dict, List, Optional
+from ts_ollama_client import get_ollama_client
+
+FILTER_MODEL = "kenneth85/llama-3-taiwan:8b-instruct-dpo-q8_0"
+# 讓模型在多次查詢之間保持載入，而不是每次呼叫後卸載
+FILTER_KEEP_ALIVE = os.getenv('OLLAMA_KEEP_ALIVE', '30m')
+
+FILTER_PROMPT = """
+    請你幫我從以下車禍案件的事故詳情中提取資訊，並只能用以下 JSON 格式輸出:
+    {{{fields}}}
+
+    以下是本起車禍的事故詳情：
+    {reason}
+    備註:
+    如果未提及原告或被告的姓名或代稱需寫為"未提及"
+{notes}
+    請依照格式輸出 JSON，不要輸出其他多餘的內容
+    """
+
+# 三個是/否判斷: (JSON 欄位, 備註, 觸發詞)
+# 三者分別決定 §187、§188、§190 是否適用，觸發詞只列出明確的用語
+CASE_FLAGS = {
+    "minor": (
+        "被告是否為未成年人",
+        "如果未提及被告的年齡，\"被告是否為未成年人\"就判斷為否",
+        re.compile(r"未成年|未滿|歲|少年|少女|兒童|孩童|小孩|孩子|幼童|幼兒|學生|國小|國中|高中|小學|中學|"
+                   r"法定代理人|監護|子女|兒子|女兒")
+    ),
+    "employee": (
+        "被告是否為受僱人",
+        "如果未提及被告是否為正在執行職務的受僱人，\"被告是否為受僱人\"就判斷為否",
+        re.compile(r"受僱|受雇|僱用|雇用|僱傭|雇傭|僱主|雇主|僱員|雇員|員工|執行職務|職務上|外送|送貨|貨運|物流")
+    ),
+    "animal": (
+        "車禍是否由動物造成",
+        "如果未提及車禍是否由動物造成，\"車禍是否由動物造成\"就判斷為否",
+        re.compile(r"動物|狗|犬|貓|寵物|牛|羊|豬|鹿|猴|鳥|禽|野生")
+    ),
+}
+
+# 沒有觸發詞時直接判斷為否的判斷，由 PRESCREEN_HARD_NEGATIVE_FLAGS 以逗號分隔設定
+# 三個判斷都會影響適用的賠償法條，觸發詞漏列會讓案型判斷錯誤；預設只對觸發詞明確的 animal 啟用
+# (動物造成的車禍一定會提到該動物)，minor 與 employee 預設交給 LLM
+# 原被告姓名一律需要 LLM 擷取，所以快速判斷不會省下 LLM 呼叫，只會從擷取提示與 JSON 輸出中省略該欄位
+HARD_NEGATIVE_FLAGS = {
+    flag.strip() for flag in os.getenv('PRESCREEN_HARD_NEGATIVE_FLAGS', 'animal').split(',') if flag.strip()
+}
+
+# 快速判斷統計: fast_path 為關鍵字直接判斷 (從提示中省略) 的次數，llm 為交給 LLM 判斷的次數
+_prescreen_stats = {"fast_path": 0, "llm": 0}
+_prescreen_lock = threading.Lock()
+
 # 主函式：根據模擬輸入，回傳清洗後的描述（包含原被告姓名、是否為未成年、是否為受僱人、是否由動物造成）
 def generate_filter(sim_input: str) -> str:
     match = re.search(r'一、(.*?)二、(.*?)三、(.*)', sim_input, re.S)
     user_input = match.group(1).strip()
-    people_info = get_people(user_input)
-    filted=people_info+"\n"+get_187(user_input)+"\n"+get_188(user_input)+"\n"+get_190(user_input)+"\n"
-
-    # Extract plaintiff info
-    plaintiffs_line = ""
-    for line in people_info.split('\n'):
-        if line.startswith("原告:"):
-            plaintiffs_line = line
-            break
+    info = extract_case_info(user_input)
+
+    plaintiffs_line = "原告:" + ",".join(info["plaintiffs"])
+    people_info = plaintiffs_line + "\n被告:" + ",".join(info["defendants"])
+    print(people_info)
+    filted = (people_info + "\n"
+              + f"被告是否為未成年人:{info['minor']}\n"
+              + f"被告是否為受僱人:{info['employee']}\n"
+              + f"車禍是否由動物造成:{info['animal']}\n")
     return filted, plaintiffs_line
-# 判斷是否為未成年人 (§187)
-def get_187(user_input: str) -> str:
-    llm = OllamaLLM(model="kenneth85/llama-3-taiwan:8b-instruct-dpo-q8_0",
-                    temperature=0,
-                    keep_alive=0,
-                    )
-    # 創建 LLMChain
-    # 定義提示模板
-    prompt_template = PromptTemplate(
-        input_variables=["reason"],
-        template="""
-    請你幫我從以下車禍案件的事故詳情中判斷被告是否為未成年人，並只能用以下格式輸出:
-    被告是否為未成年人:(是/否)
 
-    以下是本起車禍的事故詳情：
-    {reason}
-    備註:
-    如果未提及被告的年齡就判斷為否
-    你只需要告訴我被告是不是未成年人，請依照格式輸出，不要輸出其他多餘的內容
-    輸出時記得按照格式在是或否前加上:"被告是否為未成年人"
-    """
-    )
-    llm_chain = LLMChain(llm=llm, prompt=prompt_template)
-    # 傳入數據生成起訴書
-    filtered_input = llm_chain.run({
-        "reason" : user_input
-    })
-    #print(filtered_input)
-    return filtered_input
-# 判斷是否為受僱人 (§188)
-def get_188(user_input: str) -> str:
-    llm = OllamaLLM(model="kenneth85/llama-3-taiwan:8b-instruct-dpo-q8_0",
-                    temperature=0,
-                    keep_alive=0,
-                    )
-    # 創建 LLMChain
-    # 定義提示模板
-    prompt_template = PromptTemplate(
-        input_variables=["reason"],
-        template="""
-    請你幫我從以下車禍案件的事故詳情中判斷被告在車禍發生時是否為正在執行職務的受僱人，並只能用以下格式輸出:
-    被告是否為受僱人:(是/否)
+# 以關鍵字預先判斷三個是/否問題；只有 HARD_NEGATIVE_FLAGS 中沒有觸發詞的判斷直接回答否，其餘 (None) 交給 LLM
+def prescreen_flags(user_input: str) -> Dict[str, Optional[str]]:
+    flags = {
+        flag: "否" if flag in HARD_NEGATIVE_FLAGS and not pattern.search(user_input) else None
+        for flag, (_, _, pattern) in CASE_FLAGS.items()
+    }
+    decided = sum(1 for value in flags.values() if value is not None)
+    with _prescreen_lock:
+        _prescreen_stats["fast_path"] += decided
+        _prescreen_stats["llm"] += len(flags) - decided
+    return flags
 
-    以下是本起車禍的事故詳情：
-    {reason}
-    備註:
-    如果未提及被告是否為正在執行職務的受僱人就判斷為否
-    你只需要告訴我被告是不是受僱人，請依照格式輸出，不要輸出其他多餘的內容
-    輸出時記得按照格式在是或否前加上:"被告是否為受僱人:"
-    """
-    )
-    llm_chain = LLMChain(llm=llm, prompt=prompt_template)
-    # 傳入數據生成起訴書
-    filtered_input = llm_chain.run({
-        "reason" : user_input
-    })
-    #print(filtered_input)
-    return filtered_input
-# 判斷是否為動物造成 (§190)
-def get_190(user_input: str) -> str:
-
-    llm = OllamaLLM(model="kenneth85/llama-3-taiwan:8b-instruct-dpo-q8_0",
-                    temperature=0,
-                    keep_alive=0,
-                    )
-    # 創建 LLMChain
-    # 定義提示模板
-    prompt_template = PromptTemplate(
-        input_variables=["reason"],
-        template="""
-    請你幫我從以下車禍案件的事故詳情中判斷車禍是否由動物造成，並只能用以下格式輸出:
-    車禍是否由動物造成:(是/否)
+def get_prescreen_stats() -> Dict[str, float]:
+    """回傳快速判斷的次數與比例，用於調整觸發詞"""
+    with _prescreen_lock:
+        stats = dict(_prescreen_stats)
+    total = stats["fast_path"] + stats["llm"]
+    stats["fast_path_rate"] = stats["fast_path"] / total if total else 0.0
+    return stats
 
-    以下是本起車禍的事故詳情：
-    {reason}
-    備註:
-    如果未提及車禍是否由動物造成就判斷為否
-    你只需要告訴我車禍是否由動物造成，請依照格式輸出，不要輸出其他多餘的內容
-    輸出時記得按照格式在是或否前加上:"車禍是否由動物造成"
-    """
-    )
-    llm_chain = LLMChain(llm=llm, prompt=prompt_template)
-    # 傳入數據生成起訴書
-    filtered_input = llm_chain.run({
-        "reason" : user_input
-    })
-    #print(filtered_input)
-    return filtered_input
-# 擷取原告與被告姓名
-def get_people(user_input: str) -> str:
-    llm = OllamaLLM(model="kenneth85/llama-3-taiwan:8b-instruct-dpo-q8_0",
-                    temperature=0,
-                    keep_alive=0,
-                    )
-    # 創建 LLMChain
-    # 定義提示模板
-    prompt_template = PromptTemplate(
-        input_variables=["reason"],
-        template="""
-    請你幫我從以下車禍案件的事故詳情中提取並列出所有原告和被告的姓名，並只能用以下格式輸出:
-    原告:原告1,原告2...
-    被告:被告1,被告2...
+# 以一次 LLM 呼叫擷取原告、被告與快速判斷無法決定的是/否判斷 (§187、§188、§190)
+# 快速判斷已決定的判斷不列入 JSON 欄位，呼叫本身一定會發生
+def extract_case_info(user_input: str) -> Dict:
+    flags = prescreen_flags(user_input)
+    pending = [flag for flag, value in flags.items() if value is None]
 
-    以下是本起車禍的事故詳情：
-    {reason}
-    備註:
-    如果未提及原告或被告的姓名或代稱需寫為"未提及"
-    你只需要列出原告和被告的姓名，請不要輸出其他多餘的內容
-    """
-    )
-    llm_chain = LLMChain(llm=llm, prompt=prompt_template)
-    # 傳入數據生成起訴書
-    filtered_input = llm_chain.run({
-        "reason" : user_input
-    })
-    print(filtered_input)
-    return filtered_input
-#print(generate_filter(user_input))
\ No newline at end of file
+    fields = ['"原告": ["原告1", "原告2"]', '"被告": ["被告1", "被告2"]']
+    fields += [f'"{CASE_FLAGS[flag][0]}": "是/否"' for flag in pending]
+    notes = "\n".join(f"    {CASE_FLAGS[flag][1]}" for flag in pending)
+
+    try:
+        response = get_ollama_client().post('/api/generate', {
+            "model": FILTER_MODEL,
+            "prompt": FILTER_PROMPT.format(fields=", ".join(fields), reason=user_input, notes=notes),
+            "format": "json",
+            "stream": False,
+            "keep_alive": FILTER_KEEP_ALIVE,
+            "options": {"temperature": 0}
+        })
+        if response.status_code != 200:
+            raise ConnectionError(f"Ollama API 回應狀態碼 {response.status_code}")
+        parsed = json.loads(response.json()['response'])
+        if not isinstance(parsed, dict):
+            raise ValueError(f"無法解析的輸出: {parsed}")
+    except Exception as e:
+        print(f"擷取案件資訊時發生錯誤: {str(e)}")
+        raise
+
+    for flag in pending:
+        flags[flag] = _parse_flag(parsed.get(CASE_FLAGS[flag][0]))
+
+    return {
+        "plaintiffs": _parse_names(parsed.get("原告")),
+        "defendants": _parse_names(parsed.get("被告")),
+        **flags
+    }
+
+def _parse_names(value) -> List[str]:
+    if isinstance(value, str):
+        value = re.split(r"[,、，]", value)
+    names = [str(name).strip() for name in value or [] if str(name).strip()]
+    return names or ["未提及"]
+
+def _parse_flag(value) -> str:
+    if isinstance(value, bool):
+        return "是" if value else "否"
+    value = str(value).strip().lower()
+    return "是" if value.startswith("是") or value in ("yes", "true") else "否"
@@ -0,0 +1,111 @@
+# ts_law_catalog.py
+import threading
+import time
+import weakref
+from typing import Dict, List, Optional
+
+# Every live catalog in this process, so law rewrites can invalidate them
+_catalogs = weakref.WeakSet()
+
+def invalidate_all_law_catalogs():
+    """Mark every LawCatalog in this process as stale; they reload on the next lookup"""
+    for catalog in list(_catalogs):
+        catalog.invalidate()
+
+def bump_law_catalog_version(session):
+    """Record in Neo4j that the laws changed, so catalogs in other processes reload them"""
+    session.run("""
+        MERGE (v:law_catalog_version {name: 'law_catalog'})
+        SET v.version = coalesce(v.version, 0) + 1, v.updated = timestamp()
+        """).consume()
+
+def _read_law_catalog_version(session) -> Optional[int]:
+    record = session.run("""
+        MATCH (v:law_catalog_version {name: 'law_catalog'})
+        RETURN v.version AS version
+        """).single()
+    return record["version"] if record else None
+
+
+class LawCatalog:
+    """
+    In-memory copy of all law_node and law_explain_node contents.
+
+    The law set is small and rarely changes, so it is loaded from Neo4j once
+    and lookups are served from memory until invalidate() is called. Writers in
+    other processes bump a version node in Neo4j; at most every check_interval
+    seconds a lookup compares that version with the loaded one and reloads
+    the catalog when it changed.
+    """
+
+    def __init__(self, driver, check_interval: Optional[float] = 60.0):
+        self.driver = driver
+        self.check_interval = check_interval
+        self._contents: Dict[str, str] = {}
+        self._explanations: Dict[str, str] = {}
+        self._loaded = False
+        self._version: Optional[int] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        _catalogs.add(self)
+
+    def load(self):
+        with self.driver.session() as session:
+            version = _read_law_catalog_version(session)
+            result = session.run("""
+                MATCH (l:law_node)
+                OPTIONAL MATCH (l)-[:law_explain_relation]->(e:law_explain_node)
+                RETURN l.number AS number, l.content AS content, e.explanation AS explanation
+                """)
+            contents, explanations = {}, {}
+            for record in result:
+                if record["content"]:
+                    contents[record["number"]] = record["content"]
+                if record["explanation"]:
+                    explanations[record["number"]] = record["explanation"]
+
+        with self._lock:
+            self._contents = contents
+            self._explanations = explanations
+            self._version = version
+            self._checked_at = time.monotonic()
+            self._loaded = True
+        print(f"法條目錄載入完成，共 {len(contents)} 條")
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded = False
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.load()
+        elif self._is_stale():
+            print("法條目錄已被其他程序更新，重新載入")
+            self.load()
+
+    def _is_stale(self) -> bool:
+        """Compare the version node with the loaded version, at most once per check_interval"""
+        if self.check_interval is None:
+            return False
+        with self._lock:
+            if time.monotonic() - self._checked_at < self.check_interval:
+                return False
+            self._checked_at = time.monotonic()
+
+        with self.driver.session() as session:
+            return _read_law_catalog_version(session) != self._version
+
+    def get_content(self, number: str) -> str:
+        self._ensure_loaded()
+        return self._contents.get(number, "")
+
+    def get_explanation(self, number: str) -> str:
+        self._ensure_loaded()
+        return self._explanations.get(number, "")
+
+    def get_contents(self, numbers: Optional[List[str]] = None) -> Dict[str, str]:
+        """Return {number: content} for the given law numbers (all laws if None)"""
+        self._ensure_loaded()
+        if numbers is None:
+            return dict(self._contents)
+        return {number: self._contents[number] for number in numbers if number in self._contents}
@@ -0,0 +1,121 @@
+# ts_llm_cache.py
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+class LLMResponseCache:
+    """
+    Persistent cache for LLM responses.
+
+    Responses are stored in a single SQLite file, keyed by
+    sha256(model name + request options + sha256(prompt)). Entries older than
+    ttl_seconds are treated as misses and removed; when the number of entries
+    exceeds max_entries the least recently used entries are evicted. Hits and
+    misses are counted per stage.
+    """
+
+    def __init__(self, path: str, max_entries: int = 50000, ttl_seconds: Optional[float] = 7 * 24 * 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._stage_stats: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                created REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses(last_access)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_created ON responses(created)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model_name: str, options: Dict, prompt: str) -> str:
+        prompt_hash = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+        options_text = json.dumps(options or {}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(f"{model_name}\0{options_text}\0{prompt_hash}".encode('utf-8')).hexdigest()
+
+    def _count(self, stage: str, field: str):
+        stats = self._stage_stats.setdefault(stage, {"hits": 0, "misses": 0})
+        stats[field] += 1
+
+    def get(self, model_name: str, options: Dict, prompt: str, stage: str = "default") -> Optional[str]:
+        """Return the cached response, or None on a miss or an expired entry"""
+        key = self.make_key(model_name, options, prompt)
+        now = time.time()
+
+        with self._lock:
+            row = self._conn.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl_seconds is not None and now - row[1] > self.ttl_seconds:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                row = None
+
+            if row is None:
+                self._count(stage, "misses")
+                return None
+
+            self._count(stage, "hits")
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            return row[0]
+
+    def put(self, model_name: str, options: Dict, prompt: str, response: str):
+        """Store a response and evict expired and least recently used entries if needed"""
+        key = self.make_key(model_name, options, prompt)
+        now = time.time()
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created, last_access) VALUES (?, ?, ?, ?)",
+                (key, response, now, now))
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float):
+        if self.ttl_seconds is not None:
+            self._conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl_seconds,))
+
+        count = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute("""
+                DELETE FROM responses WHERE key IN (
+                    SELECT key FROM responses ORDER BY last_access ASC LIMIT ?
+                )
+                """, (overflow,))
+
+    def stats(self) -> Dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            stages = {stage: dict(stats) for stage, stats in self._stage_stats.items()}
+
+        for stats in stages.values():
+            total = stats["hits"] + stats["misses"]
+            stats["hit_rate"] = stats["hits"] / total if total else 0.0
+
+        hits = sum(stats["hits"] for stats in stages.values())
+        misses = sum(stats["misses"] for stats in stages.values())
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "entries": entries,
+            "stages": stages
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -3,28 +3,36 @@ import sys
 from datetime import datetime
 import os
 import re
-from sklearn.metrics.pairwise import cosine_similarity
 from docx import Document
 import pandas as pd
 from dotenv import load_dotenv
 from ts_models import EmbeddingModel
 from ts_text_processor import TextProcessor
+from ts_chunker import SemanticChunker
+from ts_chunk_classifier import EmbeddingChunkClassifier
 from ts_elasticsearch_utils import ElasticsearchManager
 from ts_neo4j_manager import Neo4jManager
 from ts_define_case_type import get_case_type
-from typing import List, Dict
+from ts_input_filter import get_prescreen_stats
+from typing import List, Dict, Optional
 import warnings
 
 warnings.filterwarnings("ignore")
 
 class LegalRAGSystem:
-    def __init__(self):
+    def __init__(self, pool_chunk_embeddings: bool = False, use_embedding_classifier: Optional[bool] = None):
         load_dotenv()
-        self.embedding_model = EmbeddingModel()
+        # Build chunk vectors from the sentence embeddings computed during chunking
+        # instead of embedding every chunk again
+        self.pool_chunk_embeddings = pool_chunk_embeddings
+        self.embedding_model = EmbeddingModel(
+            max_in_flight=int(os.getenv('OLLAMA_NUM_PARALLEL', '4'))
+        )
         self.es_manager = ElasticsearchManager(
             host="https://localhost:9200",
             username=os.getenv('ELASTIC_USER'),
-            password=os.getenv('ELASTIC_PASSWORD')
+            password=os.getenv('ELASTIC_PASSWORD'),
+            bulk=True
         )
         self.neo4j_manager = Neo4jManager(
             uri=os.getenv('NEO4J_URI'),
@@ -35,6 +43,25 @@ class LegalRAGSystem:
         sample_embedding = self.embedding_model.embed_texts(["測試文本"])[0]
         self.es_manager.setup_indices(len(sample_embedding))
 
+        # Optionally classify chunks by their embedding and only ask the LLM when unsure
+        # (default: CHUNK_CLASSIFIER_ENABLED env, off). Centroids are trained once from
+        # Elasticsearch and saved to CHUNK_CLASSIFIER_PATH; routing stays off until the
+        # classifier reaches CHUNK_CLASSIFIER_MIN_ACCURACY on held-out labelled chunks
+        # at CHUNK_CLASSIFIER_THRESHOLD.
+        if use_embedding_classifier is None:
+            use_embedding_classifier = os.getenv('CHUNK_CLASSIFIER_ENABLED', '0').lower() in ('1', 'true', 'yes')
+        self.chunk_classifier = None
+        if use_embedding_classifier:
+            self.chunk_classifier = EmbeddingChunkClassifier(
+                threshold=float(os.getenv('CHUNK_CLASSIFIER_THRESHOLD', '0.02')),
+                min_accuracy=float(os.getenv('CHUNK_CLASSIFIER_MIN_ACCURACY', '0.95'))
+            )
+            centroids_path = os.getenv('CHUNK_CLASSIFIER_PATH', 'ts_chunk_centroids.npz')
+            if not self.chunk_classifier.load(centroids_path):
+                self.chunk_classifier.fit_from_elasticsearch(self.es_manager)
+                if self.chunk_classifier.is_fitted:
+                    self.chunk_classifier.save(centroids_path)
+
     def read_docx(self, filename: str) -> str:
         try:
             doc = Document(filename)
@@ -44,52 +71,93 @@ class LegalRAGSystem:
             raise
 
     def process_lawyer_input(self, case_text: str, case_id: int):
-        """Process lawyer_input: store full text and chunks in Elasticsearch using chunking and LLM classification"""
+        """Process lawyer_input: store full text and chunks in Elasticsearch using chunking and LLM classification.
+        Chunk ids are numbered from 1 per case, so processing a case again overwrites its documents."""
         try:
-            # Classify the case type
-            case_type = get_case_type(case_text)
-            print(f"案件 {case_id} 分類為: {case_type}")
-            
-            # Store full text in Elasticsearch with case_type
-            full_embedding = self.embedding_model.embed_texts([case_text])[0]
-            full_chunk_id = f"{case_id}-full"
+            case_type = self.classify_lawyer_input(case_text, case_id)
+            embedded = self.embed_lawyer_input(case_text)
+            self.index_lawyer_input(case_text, case_id, case_type, embedded)
+        except Exception as e:
+            print(f"處理 lawyer_input 案件 {case_id} 時發生錯誤: {str(e)}")
+            raise
+
+    def classify_lawyer_input(self, case_text: str, case_id: int) -> str:
+        """Classify the case type of a lawyer_input"""
+        case_type = get_case_type(case_text)
+        print(f"案件 {case_id} 分類為: {case_type}")
+        return case_type
+
+    def embed_lawyer_input(self, case_text: str, chunk_types: List[str] = None) -> Dict:
+        """
+        Chunk, embed and classify a lawyer_input
+
+        Args:
+            case_text: Full lawyer_input text
+            chunk_types: Chunk labels from an earlier run; used instead of classifying
+                again when they match the number of chunks
+
+        Returns:
+            Dictionary with full_embedding, chunks, chunk_embeddings and chunk_types
+        """
+        full_embedding = self.embedding_model.embed_texts([case_text])[0]
+
+        # Truncate the text - remove part starting with a space or newline followed by "三、"
+        truncated_text = re.split(r'[\s\n]三、', case_text)[0]
+
+        # Remove all spaces and newlines from the truncated text
+        truncated_text = re.sub(r'\s+', '', truncated_text)
+
+        # Chunk the text using semantic chunking
+        if self.pool_chunk_embeddings:
+            chunks, chunk_embeddings = self.chunk_text_with_embeddings(truncated_text)
+        else:
+            chunks = self.chunk_text(truncated_text)
+            # Embed all chunks in one call so the requests run concurrently
+            chunk_embeddings = self.embedding_model.embed_texts(chunks) if chunks else []
+
+        # Classify all chunks of the case at once
+        if chunk_types is None or len(chunk_types) != len(chunks):
+            if self.chunk_classifier:
+                chunk_types = self.chunk_classifier.classify_many(chunks, chunk_embeddings)
+            else:
+                chunk_types = TextProcessor.classify_chunks(chunks)
+
+        return {
+            "full_embedding": full_embedding,
+            "chunks": chunks,
+            "chunk_embeddings": chunk_embeddings,
+            "chunk_types": chunk_types
+        }
+
+    def index_lawyer_input(self, case_text: str, case_id: int, case_type: str, embedded: Dict):
+        """Store the full text and the chunks of an embedded lawyer_input in Elasticsearch"""
+        # Store full text in Elasticsearch with case_type
+        self.es_manager.store_embedding(
+            "full",
+            case_id,
+            f"{case_id}-full",
+            case_text,
+            embedded["full_embedding"].tolist(),
+            case_type=case_type  # Add case_type parameter
+        )
+
+        # Number chunks locally; the ids are deterministic, so re-indexing a case overwrites in place
+        chunk_sequences = {}
+        for chunk, embedding, chunk_type in zip(embedded["chunks"], embedded["chunk_embeddings"], embedded["chunk_types"]):
+            chunk_id = f"{case_id}-{chunk_type}-{self._generate_chunk_sequence(chunk_sequences, chunk_type)}"
             self.es_manager.store_embedding(
-                "full",
+                chunk_type,
                 case_id,
-                full_chunk_id,
-                case_text,
-                full_embedding.tolist(),
+                chunk_id,
+                chunk,
+                embedding.tolist(),
                 case_type=case_type  # Add case_type parameter
             )
-            
-            # Truncate the text - remove part starting with a space or newline followed by "三、"
-            truncated_text = re.split(r'[\s\n]三、', case_text)[0]
-    
-            # Remove all spaces and newlines from the truncated text
-            truncated_text = re.sub(r'\s+', '', truncated_text)
-    
-            # Chunk the text using semantic chunking
-            chunks = self.chunk_text(truncated_text)
-            for chunk in chunks:
-                chunk_type = TextProcessor.classify_chunk(chunk)
-                embedding = self.embedding_model.embed_texts([chunk])[0]
-                chunk_id = f"{case_id}-{chunk_type}-{self._generate_chunk_sequence(case_id, chunk_type)}"
-                self.es_manager.store_embedding(
-                    chunk_type,
-                    case_id,
-                    chunk_id,
-                    chunk,
-                    embedding.tolist(),
-                    case_type=case_type  # Add case_type parameter
-                )
-        except Exception as e:
-            print(f"處理 lawyer_input 案件 {case_id} 時發生錯誤: {str(e)}")
-            raise
         
-    def _generate_chunk_sequence(self, case_id: int, chunk_type: str) -> int:
-        """Generate sequence number for chunk ID in Elasticsearch"""
-        count = self.es_manager.get_chunk_count(case_id, chunk_type)
-        return count + 1
+    def _generate_chunk_sequence(self, chunk_sequences: Dict[str, int], chunk_type: str) -> int:
+        """Generate sequence number for chunk ID from the per-case counters"""
+        chunk_sequences[chunk_type] = chunk_sequences.get(chunk_type, 0) + 1
+        return chunk_sequences[chunk_type]
 
     def process_indictment(self, indictment_text: str, case_id: int):
         """Process indictment: store full text and split into nodes in Neo4j"""
@@ -115,59 +183,60 @@ class LegalRAGSystem:
             print(f"處理案件 {case_id} 的法條時發生錯誤: {str(e)}")
             raise
 
-    def chunk_text(self, text: str, percentage: int = 70, min_chunk_chars: int = 50, max_chunk_chars: int = 230) -> List[str]:
-        sentences = re.split(r'[，。]', text)
-        sentences = [{'sentence': x.strip(), 'index': i} for i, x in enumerate(sentences) if x.strip()]
-
-        embeddings = self.embedding_model.embed_texts([x['sentence'] for x in sentences])
-
-        distances = []
-        for i in range(len(sentences) - 1):
-            similarity = cosine_similarity([embeddings[i]], [embeddings[i + 1]])[0][0]
-            distances.append(similarity)
-            sentences[i]['distance_to_next'] = similarity
-
-        sorted_distances = sorted(distances)
-        cutoff_index = int(len(sorted_distances) * (100 - percentage) / 100)
-        threshold = sorted_distances[cutoff_index]
-
-        indices_above_thresh = [i for i, x in enumerate(distances) if x < threshold]
-
-        chunks = []
-        start_index = 0
-        current_chars = 0
-
-        for i in range(len(sentences)):
-            current_sentence = sentences[i]['sentence']
-            sentence_chars = len(current_sentence)
-
-            # If adding this sentence would exceed max_chunk_chars, split here
-            if i > start_index and current_chars + sentence_chars > max_chunk_chars:
-                group = sentences[start_index:i]
-                combined_text = '。'.join([d['sentence'] for d in group]) + '。'
-                chunks.append(combined_text)
-                start_index = i
-                current_chars = sentence_chars
-            else:
-                current_chars += sentence_chars
+    def process_indictments(self, cases: List[Dict]):
+        """Process many indictments at once with batched Neo4j writes"""
+        try:
+            self.neo4j_manager.create_indictment_nodes_batch(cases)
+        except Exception as e:
+            print(f"批次處理 indictment 案件時發生錯誤: {str(e)}")
+            raise
+
+    def process_used_laws_many(self, used_laws: Dict[int, str]):
+        """Process used laws of many indictment cases with batched Neo4j writes"""
+        try:
+            rows = []
+            for case_id, used_laws_str in used_laws.items():
+                # Blank cells are read from Excel as NaN
+                if not isinstance(used_laws_str, str):
+                    print(f"警告：案件 {case_id} 的法條欄位空白")
+                    continue
+                law_numbers = TextProcessor.extract_law_numbers(used_laws_str)
+                if not law_numbers:
+                    print(f"警告：案件 {case_id} 沒有有效的法條")
+                    continue
+                rows.extend({"case_id": case_id, "law_number": law_number} for law_number in law_numbers)
+
+            self.neo4j_manager.create_law_relationships_batch(rows)
+            print(f"已建立 {len(rows)} 筆法條關聯")
+        except Exception as e:
+            print(f"批次處理法條時發生錯誤: {str(e)}")
+            raise
 
-            # If this is a semantic split point and we have at least min_chunk_chars
-            if i < len(distances) and distances[i] < threshold and current_chars >= min_chunk_chars:
-                group = sentences[start_index:i+1]
-                combined_text = '。'.join([d['sentence'] for d in group]) + '。'
-                chunks.append(combined_text)
-                start_index = i + 1
-                current_chars = 0
+    def _make_chunker(self, percentage: int = 70, min_chunk_chars: int = 50, max_chunk_chars: int = 230) -> SemanticChunker:
+        return SemanticChunker(
+            self.embedding_model.embed_texts,
+            percentage=percentage,
+            min_chunk_chars=min_chunk_chars,
+            max_chunk_chars=max_chunk_chars
+        )
 
-        # Add the last chunk if there's anything left
-        if start_index < len(sentences):
-            combined_text = '。'.join([d['sentence'] for d in sentences[start_index:]]) + '。'
-            chunks.append(combined_text)
+    def chunk_text(self, text: str, percentage: int = 70, min_chunk_chars: int = 50, max_chunk_chars: int = 230) -> List[str]:
+        return self._make_chunker(percentage, min_chunk_chars, max_chunk_chars).split(text)
 
-        return chunks
+    def chunk_text_with_embeddings(self, text: str, percentage: int = 70, min_chunk_chars: int = 50, max_chunk_chars: int = 230):
+        """Chunk text and return chunk vectors pooled from the sentence embeddings"""
+        chunks, embeddings = self._make_chunker(percentage, min_chunk_chars, max_chunk_chars).split_with_embeddings(text, pool=True)
+        return chunks, embeddings if embeddings is not None else []
 
     def close(self):
-        self.neo4j_manager.close()
+        if self.chunk_classifier:
+            print(f"Chunk 分類統計: {self.chunk_classifier.stats}")
+        print(f"案型關鍵字快速判斷統計: {get_prescreen_stats()}")
+        try:
+            self.es_manager.close()
+        finally:
+            self.neo4j_manager.close()
+            self.embedding_model.close()
 
     def main(self):
         try:
@@ -249,10 +318,12 @@ class LegalRAGSystem:
                 start_row = int(input("Enter start row: ").strip())
                 end_row = int(input("Enter end row: ").strip())
 
-                for i, (_, row) in enumerate(df[column][start_row:end_row+1].items()):
-                    current_case_id = start_case_id + i
-                    print(f"\n處理 indictment 案件 {current_case_id}...")
-                    self.process_indictment(row, current_case_id)
+                cases = [
+                    {"case_id": start_case_id + i, "indictment_text": row}
+                    for i, (_, row) in enumerate(df[column][start_row:end_row+1].items())
+                ]
+                print(f"\n處理 indictment 案件 {start_case_id} 至 {start_case_id + len(cases) - 1}...")
+                self.process_indictments(cases)
 
                 # Process used laws for indictment
                 print("\n處理法條...")
@@ -269,10 +340,11 @@ class LegalRAGSystem:
                 start_row = int(input("Enter start row: ").strip())
                 end_row = int(input("Enter end row: ").strip())
                         
-                for i, (_, row) in enumerate(laws_df[column][start_row:end_row+1].items()):
-                    current_case_id = start_case_id + i
-                    print(f"\n處理案件 {current_case_id} 的法條...")
-                    self.process_used_laws(current_case_id, row)
+                used_laws = {
+                    start_case_id + i: row
+                    for i, (_, row) in enumerate(laws_df[column][start_row:end_row+1].items())
+                }
+                self.process_used_laws_many(used_laws)
 
         except Exception as e:
             print(f"執行過程中發生錯誤: {str(e)}")
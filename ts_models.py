@@ -1,38 +1,141 @@
 # ts_models.py
-from typing import List
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
 import numpy as np
-import requests
+from ts_embedding_cache import EmbeddingCache
+from ts_ollama_client import get_ollama_client
+
+# Read timeout of one /api/embed request: a fixed allowance plus a per-text share,
+# capped at the client's default read timeout
+EMBED_BASE_TIMEOUT = 60.0
+EMBED_TIMEOUT_PER_TEXT = 10.0
 
 class EmbeddingModel:
-    def __init__(self):
+    def __init__(self, batch_size: int = 32, use_cache: bool = True, max_in_flight: int = 1):
         self.model_name = "kenneth85/llama-3-taiwan:8b-instruct-dpo"
         self.embedding_dim = 4096
-        
-    def embed_texts(self, texts: List[str]) -> np.ndarray:
-        embeddings = []
-        
-        for text in texts:
+        # Number of texts sent per /api/embed request; 1 falls back to the legacy /api/embeddings endpoint
+        self.batch_size = batch_size
+        # Maximum number of concurrent requests to Ollama (should not exceed OLLAMA_NUM_PARALLEL)
+        self.max_in_flight = max(1, max_in_flight)
+
+        # Shared pooled client so concurrent requests reuse keep-alive connections
+        self.client = get_ollama_client()
+
+        # On-disk cache so re-runs only embed text that has never been seen
+        self.cache = None
+        if use_cache:
             try:
-                response = requests.post(
-                    'http://localhost:11434/api/embeddings',
-                    json={
-                        "model": self.model_name,
-                        "prompt": text
-                    }
+                self.cache = EmbeddingCache(
+                    os.getenv('EMBEDDING_CACHE_PATH', 'ts_embedding_cache.sqlite3'),
+                    max_entries=int(os.getenv('EMBEDDING_CACHE_MAX_ENTRIES', '200000'))
                 )
-                
-                if response.status_code == 200:
-                    embedding = response.json()['embedding']
-                    embeddings.append(embedding)
-                else:
-                    raise Exception(f"Error getting embedding: {response.status_code}")
-                    
-            except Exception as e:
-                print(f"Error processing text: {str(e)}")
-                raise
-                
-        embeddings_array = np.array(embeddings)
+            except sqlite3.Error as e:
+                print(f"無法開啟 embedding 快取，停用快取: {str(e)}")
+
+    def embed_texts(self, texts: List[str], batch_size: Optional[int] = None) -> np.ndarray:
+        batch_size = batch_size or self.batch_size
+        # /api/embed returns L2-normalized vectors, /api/embeddings raw ones; keep them apart in the cache
+        cache_variant = "api/embed" if batch_size > 1 else "api/embeddings"
+
+        cached = {}
+        if self.cache:
+            # The cache is only an optimization (and may be locked by another process); never fail the embed
+            try:
+                cached = self.cache.get_many(self.model_name, texts, cache_variant)
+            except sqlite3.Error as e:
+                print(f"讀取 embedding 快取失敗，改為重新計算: {str(e)}")
+        missing_texts = list(dict.fromkeys(text for i, text in enumerate(texts) if i not in cached))
+
+        computed = {}
+        if missing_texts:
+            new_embeddings = np.array(self._compute_embeddings(missing_texts, batch_size), dtype=np.float32)
+            if new_embeddings.shape[1] != self.embedding_dim:
+                raise ValueError(f"Expected embedding dimension {self.embedding_dim}, but got {new_embeddings.shape[1]}")
+            if self.cache:
+                try:
+                    self.cache.put_many(self.model_name, missing_texts, new_embeddings, cache_variant)
+                except sqlite3.Error as e:
+                    print(f"寫入 embedding 快取失敗，略過快取: {str(e)}")
+            computed = dict(zip(missing_texts, new_embeddings))
+
+        embeddings = [cached[i] if i in cached else computed[text] for i, text in enumerate(texts)]
+
+        embeddings_array = np.array(embeddings, dtype=np.float32)
         if embeddings_array.shape[1] != self.embedding_dim:
             raise ValueError(f"Expected embedding dimension {self.embedding_dim}, but got {embeddings_array.shape[1]}")
-            
+
         return embeddings_array
+
+    def _compute_embeddings(self, texts: List[str], batch_size: int) -> List[List[float]]:
+        if batch_size > 1:
+            batches = [texts[start:start + batch_size] for start in range(0, len(texts), batch_size)]
+            embed_fn = self._embed_batch
+        else:
+            batches = texts
+            embed_fn = lambda text: [self._embed_single(text)]
+
+        # Executor.map keeps the input order, and the pool size bounds the requests in flight
+        if self.max_in_flight > 1 and len(batches) > 1:
+            with ThreadPoolExecutor(max_workers=min(self.max_in_flight, len(batches))) as executor:
+                results = list(executor.map(embed_fn, batches))
+        else:
+            results = [embed_fn(batch) for batch in batches]
+
+        return [embedding for result in results for embedding in result]
+
+    def cache_stats(self) -> dict:
+        """Return hit/miss counters of the embedding cache"""
+        return self.cache.stats() if self.cache else {}
+
+    def close(self):
+        """Close the embedding cache connection"""
+        if self.cache:
+            self.cache.close()
+            self.cache = None
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """Embed several texts in one request through Ollama's multi-input /api/embed endpoint"""
+        try:
+            response = self.client.post(
+                '/api/embed',
+                {
+                    "model": self.model_name,
+                    "input": texts
+                },
+                read_timeout=min(self.client.read_timeout, EMBED_BASE_TIMEOUT + EMBED_TIMEOUT_PER_TEXT * len(texts))
+            )
+
+            if response.status_code == 200:
+                embeddings = response.json()['embeddings']
+                if len(embeddings) != len(texts):
+                    raise Exception(f"Expected {len(texts)} embeddings, but got {len(embeddings)}")
+                return embeddings
+            else:
+                raise Exception(f"Error getting embedding: {response.status_code}")
+
+        except Exception as e:
+            print(f"Error processing batch of {len(texts)} texts: {str(e)}")
+            raise
+
+    def _embed_single(self, text: str) -> List[float]:
+        try:
+            response = self.client.post(
+                '/api/embeddings',
+                {
+                    "model": self.model_name,
+                    "prompt": text
+                },
+                read_timeout=120
+            )
+
+            if response.status_code == 200:
+                return response.json()['embedding']
+            else:
+                raise Exception(f"Error getting embedding: {response.status_code}")
+
+        except Exception as e:
+            print(f"Error processing text: {str(e)}")
+            raise
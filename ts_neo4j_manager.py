@@ -2,10 +2,17 @@
 from neo4j import GraphDatabase
 from typing import List, Dict
 import re
+from ts_law_catalog import bump_law_catalog_version, invalidate_all_law_catalogs
+from ts_neo4j_schema import INDICTMENT_SECTIONS, ensure_schema
+
+class IndictmentFormatError(ValueError):
+    """Raised when an indictment cannot be split into its sections"""
+
 
 class Neo4jManager:
     def __init__(self, uri: str, user: str, password: str):
         self.driver = GraphDatabase.driver(uri, auth=(user, password))
+        ensure_schema(self.driver)
 
     def close(self):
         if self.driver:
@@ -18,118 +25,136 @@ class Neo4jManager:
             
         with self.driver.session() as session:
             session.run("""
-                MERGE (c:case_node {case_id: $case_id, case_type: $case_type, case_text: $case_text})
+                MERGE (c:case_node {case_id: $case_id})
+                SET c.case_type = $case_type, c.case_text = $case_text
                 """, case_id=case_id, case_type=case_type, case_text=case_text)
 
+    def split_indictment(self, case_id: int, indictment_text: str) -> Dict[str, str]:
+        """
+        Split indictment into fact, law, compensation and conclusion sections
+
+        Raises:
+            IndictmentFormatError: If a section marker is missing, out of order or empty
+        """
+        # Initialize section variables
+        fact_text, law_text, compensation_text, conclusion_text = "", "", "", ""
+
+        try:
+            # Trim any leading/trailing whitespace
+            indictment_text = indictment_text.strip()
+
+            # Find positions of required markers
+            pos_1 = indictment_text.find("一、")
+
+            # For the second marker and "（一）"/"(一)", use regex to ensure there's whitespace before them
+            matches_2 = list(re.finditer(r'(?:\s)二、', indictment_text))
+            matches_section_1 = list(re.finditer(r'(?:\s)[（(]一[）)]', indictment_text))
+
+            # For the conclusion, find either "綜上所陳" or "綜上所述"
+            pos_conclusion_1 = indictment_text.find("綜上所陳")
+            pos_conclusion_2 = indictment_text.find("綜上所述")
+
+            # Use the one that appears in the text (prefer "綜上所陳" if both appear)
+            if pos_conclusion_1 != -1:
+                pos_conclusion = pos_conclusion_1
+                conclusion_marker = "綜上所陳"
+            elif pos_conclusion_2 != -1:
+                pos_conclusion = pos_conclusion_2
+                conclusion_marker = "綜上所述"
+            else:
+                pos_conclusion = -1
+                conclusion_marker = "綜上所陳/綜上所述"
+
+            # Check if all required markers exist
+            if pos_1 == -1:
+                raise IndictmentFormatError(f"起訴狀中缺少「一、」標記 (case_id: {case_id})")
+
+            if not matches_2:
+                raise IndictmentFormatError(f"起訴狀中缺少「二、」標記或其前面沒有空格/換行 (case_id: {case_id})")
+
+            if not matches_section_1:
+                raise IndictmentFormatError(f"起訴狀中缺少「（一）」或「(一)」標記或其前面沒有空格/換行 (case_id: {case_id})")
+
+            if pos_conclusion == -1:
+                raise IndictmentFormatError(f"起訴狀中缺少「綜上所陳」或「綜上所述」標記 (case_id: {case_id})")
+
+            pos_2 = matches_2[0].start() + 1  # +1 to point to the actual "二" character
+            pos_section_1 = matches_section_1[0].start() + 1  # +1 to point to the actual "（" or "(" character
+
+            # Check if they are in correct order
+            if not (pos_1 < pos_2 < pos_section_1 < pos_conclusion):
+                section_marker = indictment_text[pos_section_1:pos_section_1+3]
+                raise IndictmentFormatError(f"起訴狀標記順序錯誤: 一、({pos_1}) 二、({pos_2}) {section_marker}({pos_section_1}) {conclusion_marker}({pos_conclusion}) (case_id: {case_id})")
+
+            # Extract the content of the different parts
+            fact_text = indictment_text[pos_1:pos_2-1].strip()
+            law_text = indictment_text[pos_2:pos_section_1-1].strip()
+            compensation_text = indictment_text[pos_section_1:pos_conclusion].strip()
+            conclusion_text = indictment_text[pos_conclusion:].strip()
+
+            # Check if any section is empty
+            if not fact_text:
+                raise IndictmentFormatError(f"起訴狀「一、」部分內容為空 (case_id: {case_id})")
+            if not law_text:
+                raise IndictmentFormatError(f"起訴狀「二、」部分內容為空 (case_id: {case_id})")
+            if not compensation_text:
+                section_marker = indictment_text[pos_section_1:pos_section_1+3]
+                raise IndictmentFormatError(f"起訴狀「{section_marker}」部分內容為空 (case_id: {case_id})")
+            if not conclusion_text:
+                raise IndictmentFormatError(f"起訴狀「{conclusion_marker}」部分內容為空 (case_id: {case_id})")
+
+        except IndictmentFormatError as e:
+            print(f"錯誤: {str(e)}")
+            raise
+        except Exception as e:
+            print(f"錯誤: 分割起訴狀文本時發生錯誤 (case_id: {case_id}): {str(e)}")
+            raise IndictmentFormatError(f"分割起訴狀文本時發生錯誤 (case_id: {case_id}): {str(e)}") from e
+
+        return {
+            "fact_text": fact_text,
+            "law_text": law_text,
+            "compensation_text": compensation_text,
+            "conclusion_text": conclusion_text
+        }
+
     def create_indictment_nodes(self, case_id: int, indictment_text: str):
         """Split indictment into fact, law, compensation, conclusion and create nodes"""
-        import sys
+        sections = self.split_indictment(case_id, indictment_text)
+        fact_text = sections["fact_text"]
+        law_text = sections["law_text"]
+        compensation_text = sections["compensation_text"]
+        conclusion_text = sections["conclusion_text"]
         
         with self.driver.session() as session:
-            # Initialize section variables
-            fact_text, law_text, compensation_text, conclusion_text = "", "", "", ""
-            
-            try:
-                # Trim any leading/trailing whitespace
-                indictment_text = indictment_text.strip()
-                
-                # Find positions of required markers
-                pos_1 = indictment_text.find("一、")
-                
-                # For the second marker and "（一）"/"(一)", use regex to ensure there's whitespace before them
-                matches_2 = list(re.finditer(r'(?:\s)二、', indictment_text))
-                matches_section_1 = list(re.finditer(r'(?:\s)[（(]一[）)]', indictment_text))
-                
-                # For the conclusion, find either "綜上所陳" or "綜上所述"
-                pos_conclusion_1 = indictment_text.find("綜上所陳")
-                pos_conclusion_2 = indictment_text.find("綜上所述")
-                
-                # Use the one that appears in the text (prefer "綜上所陳" if both appear)
-                if pos_conclusion_1 != -1:
-                    pos_conclusion = pos_conclusion_1
-                    conclusion_marker = "綜上所陳"
-                elif pos_conclusion_2 != -1:
-                    pos_conclusion = pos_conclusion_2
-                    conclusion_marker = "綜上所述"
-                else:
-                    pos_conclusion = -1
-                    conclusion_marker = "綜上所陳/綜上所述"
-                
-                # Check if all required markers exist
-                if pos_1 == -1:
-                    print(f"錯誤: 起訴狀中缺少「一、」標記 (case_id: {case_id})")
-                    sys.exit(1)
-                    
-                if not matches_2:
-                    print(f"錯誤: 起訴狀中缺少「二、」標記或其前面沒有空格/換行 (case_id: {case_id})")
-                    sys.exit(1)
-                    
-                if not matches_section_1:
-                    print(f"錯誤: 起訴狀中缺少「（一）」或「(一)」標記或其前面沒有空格/換行 (case_id: {case_id})")
-                    sys.exit(1)
-                    
-                if pos_conclusion == -1:
-                    print(f"錯誤: 起訴狀中缺少「綜上所陳」或「綜上所述」標記 (case_id: {case_id})")
-                    sys.exit(1)
-                
-                pos_2 = matches_2[0].start() + 1  # +1 to point to the actual "二" character
-                pos_section_1 = matches_section_1[0].start() + 1  # +1 to point to the actual "（" or "(" character
-                
-                # Check if they are in correct order
-                if not (pos_1 < pos_2 < pos_section_1 < pos_conclusion):
-                    section_marker = indictment_text[pos_section_1:pos_section_1+3]
-                    print(f"錯誤: 起訴狀標記順序錯誤: 一、({pos_1}) 二、({pos_2}) {section_marker}({pos_section_1}) {conclusion_marker}({pos_conclusion}) (case_id: {case_id})")
-                    sys.exit(1)
-                
-                # Extract the content of the different parts
-                fact_text = indictment_text[pos_1:pos_2-1].strip()
-                law_text = indictment_text[pos_2:pos_section_1-1].strip()
-                compensation_text = indictment_text[pos_section_1:pos_conclusion].strip()
-                conclusion_text = indictment_text[pos_conclusion:].strip()
-                
-                # Check if any section is empty
-                if not fact_text:
-                    print(f"錯誤: 起訴狀「一、」部分內容為空 (case_id: {case_id})")
-                    sys.exit(1)
-                if not law_text:
-                    print(f"錯誤: 起訴狀「二、」部分內容為空 (case_id: {case_id})")
-                    sys.exit(1)
-                if not compensation_text:
-                    section_marker = indictment_text[pos_section_1:pos_section_1+3]
-                    print(f"錯誤: 起訴狀「{section_marker}」部分內容為空 (case_id: {case_id})")
-                    sys.exit(1)
-                if not conclusion_text:
-                    print(f"錯誤: 起訴狀「{conclusion_marker}」部分內容為空 (case_id: {case_id})")
-                    sys.exit(1)
-                    
-            except Exception as e:
-                print(f"錯誤: 分割起訴狀文本時發生錯誤 (case_id: {case_id}): {str(e)}")
-                sys.exit(1)
-    
             # Create nodes for each section without subnodes for compensation
+            # Each case has one node per section label, so nodes are keyed on case_id only
             session.run("""
-                MERGE (f:fact_text {case_id: $case_id, chunk: $chunk})
+                MERGE (f:fact_text {case_id: $case_id})
+                SET f.chunk = $chunk
                 WITH f
                 MATCH (c:case_node {case_id: $case_id})
                 MERGE (c)-[:fact_text_relation]->(f)
                 """, case_id=case_id, chunk=fact_text)
-    
+
             session.run("""
-                MERGE (l:law_text {case_id: $case_id, chunk: $chunk})
+                MERGE (l:law_text {case_id: $case_id})
+                SET l.chunk = $chunk
                 WITH l
                 MATCH (c:case_node {case_id: $case_id})
                 MERGE (c)-[:law_text_relation]->(l)
                 """, case_id=case_id, chunk=law_text)
-    
+
             session.run("""
-                MERGE (comp:compensation_text {case_id: $case_id, chunk: $chunk})
+                MERGE (comp:compensation_text {case_id: $case_id})
+                SET comp.chunk = $chunk
                 WITH comp
                 MATCH (c:case_node {case_id: $case_id})
                 MERGE (c)-[:compensation_text_relation]->(comp)
                 """, case_id=case_id, chunk=compensation_text)
-    
+
             session.run("""
-                MERGE (conc:conclusion_text {case_id: $case_id, chunk: $chunk})
+                MERGE (conc:conclusion_text {case_id: $case_id})
+                SET conc.chunk = $chunk
                 WITH conc
                 MATCH (c:case_node {case_id: $case_id})
                 MERGE (c)-[:conclusion_text_relation]->(conc)
@@ -172,6 +197,76 @@ class Neo4jManager:
                 MERGE (conc)-[:used_law_relation]->(l)
                 """, case_id=case_id, law_number=law_number)
 
+    def create_indictment_nodes_batch(self, cases: List[Dict], batch_size: int = 500):
+        """
+        Create case nodes and section nodes for many indictments with UNWIND
+
+        Args:
+            cases: List of {"case_id": int, "indictment_text": str}
+            batch_size: Number of cases written per transaction
+        """
+        rows = []
+        for case in cases:
+            row = {"case_id": case["case_id"], "case_text": case["indictment_text"]}
+            row.update(self.split_indictment(case["case_id"], case["indictment_text"]))
+            rows.append(row)
+
+        self.write_indictment_sections_batch(rows, batch_size)
+
+    def write_indictment_sections_batch(self, rows: List[Dict], batch_size: int = 500):
+        """
+        Write indictments that are already split into sections
+
+        Args:
+            rows: List of {"case_id", "case_text", "fact_text", "law_text", "compensation_text", "conclusion_text"}
+            batch_size: Number of cases written per transaction
+        """
+        with self.driver.session() as session:
+            for start in range(0, len(rows), batch_size):
+                session.execute_write(self._write_indictment_batch, rows[start:start + batch_size])
+                print(f"已寫入 indictment 案件 {min(start + batch_size, len(rows))}/{len(rows)}")
+
+    @staticmethod
+    def _write_indictment_batch(tx, rows: List[Dict]):
+        tx.run("""
+            UNWIND $rows AS row
+            MERGE (c:case_node {case_id: row.case_id})
+            SET c.case_type = 'indictment', c.case_text = row.case_text
+            """, rows=rows)
+
+        for label in INDICTMENT_SECTIONS:
+            tx.run(f"""
+                UNWIND $rows AS row
+                MERGE (s:{label} {{case_id: row.case_id}})
+                SET s.chunk = row.{label}
+                WITH s, row
+                MATCH (c:case_node {{case_id: row.case_id}})
+                MERGE (c)-[:{label}_relation]->(s)
+                """, rows=rows)
+
+    def create_law_relationships_batch(self, rows: List[Dict], batch_size: int = 1000):
+        """
+        Create used_law_relation edges for many (case_id, law_number) pairs with UNWIND
+
+        Args:
+            rows: List of {"case_id": int, "law_number": str}
+            batch_size: Number of pairs written per transaction
+        """
+        with self.driver.session() as session:
+            for start in range(0, len(rows), batch_size):
+                session.execute_write(self._write_law_relationships_batch, rows[start:start + batch_size])
+
+    @staticmethod
+    def _write_law_relationships_batch(tx, rows: List[Dict]):
+        # Relationship with case_node and with every section node of the case
+        for label in ["case_node"] + INDICTMENT_SECTIONS:
+            tx.run(f"""
+                UNWIND $rows AS row
+                MATCH (n:{label} {{case_id: row.case_id}})
+                MATCH (l:law_node {{number: row.law_number}})
+                MERGE (n)-[:used_law_relation]->(l)
+                """, rows=rows)
+
     def get_max_case_id(self) -> int:
         with self.driver.session() as session:
             result = session.run("""
@@ -217,4 +312,10 @@ class Neo4jManager:
                     MATCH (l:law_node {number: $number})
                     MATCH (e:law_explain_node {number: $number})
                     MERGE (l)-[:law_explain_relation]->(e)
-                    """, number=law['number'])
\ No newline at end of file
+                    """, number=law['number'])
+
+            # Let catalogs in other processes (e.g. the Gradio server) know the laws changed
+            bump_law_catalog_version(session)
+
+        # Cached law contents in this process are now out of date
+        invalidate_all_law_catalogs()
\ No newline at end of file
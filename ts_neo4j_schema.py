@@ -0,0 +1,41 @@
+# ts_neo4j_schema.py
+
+# Section node labels of an indictment; each is linked from case_node by "<label>_relation"
+INDICTMENT_SECTIONS = ["fact_text", "law_text", "compensation_text", "conclusion_text"]
+
+# (label, property) pairs that identify a node
+UNIQUE_KEYS = [
+    ("case_node", "case_id"),
+    ("law_node", "number"),
+    ("law_explain_node", "number"),
+    ("user_query", "query_id"),
+    ("law_catalog_version", "name"),
+]
+
+# (label, property) pairs looked up on every case, but not unique
+INDEXED_KEYS = [(label, "case_id") for label in INDICTMENT_SECTIONS]
+
+def ensure_schema(driver):
+    """
+    Create the constraints and indexes used by the graph queries
+
+    Every statement uses IF NOT EXISTS, so calling this on each startup is safe.
+    A constraint that cannot be created (e.g. duplicate keys in existing data)
+    only prints a warning, so the system still starts.
+    """
+    statements = [
+        f"CREATE CONSTRAINT {label}_{prop}_unique IF NOT EXISTS "
+        f"FOR (n:{label}) REQUIRE n.{prop} IS UNIQUE"
+        for label, prop in UNIQUE_KEYS
+    ] + [
+        f"CREATE INDEX {label}_{prop}_index IF NOT EXISTS "
+        f"FOR (n:{label}) ON (n.{prop})"
+        for label, prop in INDEXED_KEYS
+    ]
+
+    with driver.session() as session:
+        for statement in statements:
+            try:
+                session.run(statement).consume()
+            except Exception as e:
+                print(f"警告: 建立 Neo4j 結構失敗: {statement}: {str(e)}")
@@ -0,0 +1,75 @@
+# ts_ollama_client.py
+import os
+import threading
+from typing import Optional, Tuple
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+class OllamaClient:
+    """
+    Shared HTTP client for the Ollama API.
+
+    Keeps a pooled keep-alive session, applies (connect, read) timeouts to
+    every call and retries connection errors and 5xx responses with
+    exponential backoff. Read timeouts are not retried: generation and
+    embedding requests are long-running POSTs, and re-sending them would
+    multiply the worst-case latency and pile more work on a busy server.
+    """
+
+    def __init__(self, base_url: str = "http://localhost:11434", pool_size: int = 16,
+                 connect_timeout: float = 5.0, read_timeout: float = 600.0,
+                 retries: int = 3, backoff_factor: float = 1.0, max_generations: int = 4):
+        self.base_url = base_url.rstrip('/')
+        # Process-wide limit on generation requests in flight, whichever thread pool they come
+        # from (pipeline stages, batch law checks); callers hold a slot around each request
+        self.generation_slots = threading.BoundedSemaphore(max(1, max_generations))
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=0,
+            status=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=frozenset(['GET', 'POST']),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _timeout(self, read_timeout: Optional[float]) -> Tuple[float, float]:
+        return (self.connect_timeout, read_timeout if read_timeout is not None else self.read_timeout)
+
+    def get(self, path: str, read_timeout: Optional[float] = None) -> requests.Response:
+        return self.session.get(f"{self.base_url}{path}", timeout=self._timeout(read_timeout))
+
+    def post(self, path: str, payload: dict, read_timeout: Optional[float] = None) -> requests.Response:
+        return self.session.post(f"{self.base_url}{path}", json=payload, timeout=self._timeout(read_timeout))
+
+    def close(self):
+        self.session.close()
+
+
+_shared_client = None
+_shared_client_lock = threading.Lock()
+
+def get_ollama_client() -> OllamaClient:
+    """Return the process-wide OllamaClient, creating it from environment settings on first use"""
+    global _shared_client
+    with _shared_client_lock:
+        if _shared_client is None:
+            _shared_client = OllamaClient(
+                base_url=os.getenv('OLLAMA_BASE_URL', 'http://localhost:11434'),
+                pool_size=int(os.getenv('OLLAMA_POOL_SIZE', '16')),
+                connect_timeout=float(os.getenv('OLLAMA_CONNECT_TIMEOUT', '5')),
+                read_timeout=float(os.getenv('OLLAMA_READ_TIMEOUT', '600')),
+                retries=int(os.getenv('OLLAMA_RETRIES', '3')),
+                max_generations=int(os.getenv('OLLAMA_NUM_PARALLEL', '4'))
+            )
+        return _shared_client
@@ -0,0 +1,54 @@
+# ts_pipeline.py
+import os
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional
+
+class PipelineRunner:
+    """
+    Run independent generation stages concurrently and join their results.
+
+    Each stage is submitted under a name and runs on a bounded thread pool of
+    max_workers stages. A stage may start more requests of its own (e.g. the
+    batch law checks); the LLM requests in flight are capped for the whole
+    process by the Ollama client's generation slots, not by this pool. The
+    end-to-end latency becomes that of the longest stage instead of the sum
+    of all stages.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None):
+        self.max_workers = max_workers or int(os.getenv('PIPELINE_MAX_CONCURRENCY', '3'))
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        self._futures: Dict[str, Future] = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def submit(self, name: str, fn: Callable, *args, **kwargs):
+        self._futures[name] = self._executor.submit(fn, *args, **kwargs)
+
+    def done(self) -> bool:
+        return all(future.done() for future in self._futures.values())
+
+    def completed(self) -> List[str]:
+        """Names of the stages that have finished"""
+        return [name for name, future in self._futures.items() if future.done()]
+
+    def wait_any(self, timeout: Optional[float] = None):
+        """Block until one more stage finishes or the timeout expires"""
+        pending = [future for future in self._futures.values() if not future.done()]
+        if pending:
+            wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+    def result(self, name: str) -> Any:
+        """Result of one stage, waiting for it if needed; re-raises the stage's exception"""
+        return self._futures[name].result()
+
+    def results(self) -> Dict[str, Any]:
+        """Join all stages and return {name: result}"""
+        return {name: future.result() for name, future in self._futures.items()}
+
+    def close(self):
+        self._executor.shutdown(wait=True)
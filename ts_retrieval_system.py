@@ -5,9 +5,14 @@ from typing import List, Dict, Tuple, Optional, Union
 import re
 import time
 import os
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-import requests
 from ts_models import EmbeddingModel
+from ts_elasticsearch_utils import check_embedding_mapping
+from ts_ollama_client import get_ollama_client
+from ts_law_catalog import LawCatalog
+from ts_llm_cache import LLMResponseCache
+from ts_neo4j_schema import ensure_schema
 from ts_define_case_type import get_case_type
 from ts_prompt import (
     get_facts_prompt, 
@@ -23,9 +28,14 @@ from ts_prompt_check import (
     get_calculation_tags_check_prompt
 )
 
+# Stages whose LLM responses are cached by default: the summary and the checks.
+# Generation stages inside retry loops are left out so a retry samples a new answer.
+DEFAULT_LLM_CACHE_STAGES = "case_summary,fact_check,law_check,compensation_check,calculation_check"
+
 class RetrievalSystem:
-    def __init__(self, modelname = "gemma3:27b"):
-        """Initialize connections to Elasticsearch, Neo4j, and the embedding model"""
+    def __init__(self, modelname = "gemma3:27b", search_mode = "knn", use_llm_cache: Optional[bool] = None):
+        """Initialize connections to Elasticsearch, Neo4j, and the embedding model.
+        use_llm_cache enables the persistent LLM response cache (default: LLM_CACHE_ENABLED env)."""
         load_dotenv()
         try:
             # Initialize Elasticsearch
@@ -35,11 +45,23 @@ class RetrievalSystem:
                 verify_certs=False
             )
             self.es_index = 'ts_text_embeddings'
+            # "knn" uses the HNSW index, "exact" the brute-force script_score query
+            self.search_mode = search_mode
+            self.knn_num_candidates = 100
+            # Added to the score (cosine + 1 scale, range 0-2) of chunks of the query's case type.
+            # 2.0 ranks every chunk of that case type above all other chunks; chunks of other case
+            # types only fill the remaining places, so no second search is needed
+            self.case_type_boost = 2.0
             
             # Test Elasticsearch connection
             if not self.es.ping():
                 raise ConnectionError("無法連接到 Elasticsearch")
             
+            # An index created before the HNSW mapping only supports the exact search
+            if self.search_mode == "knn" and not check_embedding_mapping(self.es, self.es_index):
+                print("改用精確搜索")
+                self.search_mode = "exact"
+            
             # Initialize Neo4j
             self.neo4j_driver = GraphDatabase.driver(
                 os.getenv('NEO4J_URI'),
@@ -50,15 +72,47 @@ class RetrievalSystem:
             with self.neo4j_driver.session() as session:
                 session.run("RETURN 1")
             
+            # Constraints and indexes for the case, law and section lookups
+            ensure_schema(self.neo4j_driver)
+            
+            # Load all law contents once; lookups are then served from memory and
+            # reloaded when another process updates the laws (checked every LAW_CATALOG_CHECK_SECONDS)
+            self.law_catalog = LawCatalog(
+                self.neo4j_driver,
+                check_interval=float(os.getenv('LAW_CATALOG_CHECK_SECONDS', '60'))
+            )
+            self.law_catalog.load()
+            
             # Initialize embedding model
             self.embedding_model = EmbeddingModel()
             
             # Initialize LLM API settings
-            self.llm_url = "http://localhost:11434/api/generate"
+            self.ollama_client = get_ollama_client()
+            self.llm_url = "/api/generate"
             self.llm_model = modelname #"gemma3:27b" #"kenneth85/llama-3-taiwan:8b-instruct-dpo"
+            # Threads used by the batch APIs; requests actually in flight are capped process-wide
+            # by the Ollama client's generation slots (OLLAMA_NUM_PARALLEL)
+            self.llm_max_in_flight = int(os.getenv('OLLAMA_NUM_PARALLEL', '4'))
+            self.llm_options = {}
+            
+            # Optional persistent cache of LLM responses for the stages listed in LLM_CACHE_STAGES
+            if use_llm_cache is None:
+                use_llm_cache = os.getenv('LLM_CACHE_ENABLED', '0').lower() in ('1', 'true', 'yes')
+            self.llm_cache = None
+            self.llm_cache_stages = set()
+            if use_llm_cache:
+                self.llm_cache = LLMResponseCache(
+                    os.getenv('LLM_CACHE_PATH', 'ts_llm_cache.sqlite3'),
+                    max_entries=int(os.getenv('LLM_CACHE_MAX_ENTRIES', '50000')),
+                    ttl_seconds=float(os.getenv('LLM_CACHE_TTL_SECONDS', str(7 * 24 * 3600)))
+                )
+                self.llm_cache_stages = {
+                    stage.strip() for stage in os.getenv('LLM_CACHE_STAGES', DEFAULT_LLM_CACHE_STAGES).split(',')
+                    if stage.strip()
+                }
             
             # Test LLM connection
-            response = requests.get("http://localhost:11434/api/version")
+            response = self.ollama_client.get("/api/version", read_timeout=10)
             if response.status_code != 200:
                 raise ConnectionError("無法連接到 Ollama API")
             
@@ -70,18 +124,27 @@ class RetrievalSystem:
     
     def close(self):
         """Close connections"""
+        if getattr(self, 'llm_cache', None):
+            print(f"LLM 快取統計: {self.llm_cache.stats()}")
+            self.llm_cache.close()
+        if getattr(self, 'embedding_model', None):
+            self.embedding_model.close()
         if hasattr(self, 'neo4j_driver') and self.neo4j_driver:
             self.neo4j_driver.close()
     
-    def search_elasticsearch(self, query_text: str, search_type: str, k: int, query_case_type: str) -> List[Dict]:
+    def search_elasticsearch(self, query_text: str, search_type: str, k: int, query_case_type: str, search_mode: Optional[str] = None,
+                             allow_exact_fallback: bool = True) -> List[Dict]:
         """
-        Search Elasticsearch for similar documents of the specified type and case type
+        Search Elasticsearch for similar documents of the specified type, preferring the query's case type
         
         Args:
         query_text: The text to search for
         search_type: Either "full" or "fact"
         k: Number of top results to retrieve
         query_case_type: The case type determined from the query           
+        search_mode: "knn" for approximate HNSW search, "exact" for brute-force
+            script_score; defaults to self.search_mode
+        allow_exact_fallback: Use the exact search for this query if the kNN request fails
             
         Returns:
             List of dictionaries containing case_id, score, and text
@@ -91,86 +154,119 @@ class RetrievalSystem:
             print(f"使用案件類型進行搜索: {query_case_type}")
 
             # Create the embedding for the query
-            query_embedding = self.embedding_model.embed_texts([query_text])[0]
-
-            # Search in Elasticsearch with case_type filter
-            script_query = {
-                "script_score": {
-                    "query": {
-                        "bool": {
-                            "must": [
-                                {"term": {"text_type": search_type}},
-                                {"term": {"case_type": query_case_type}}
-                            ]
-                        }
-                    },
-                    "script": {
-                        "source": "cosineSimilarity(params.query_vector, 'embedding') + 1.0",
-                        "params": {"query_vector": query_embedding.tolist()}
-                    }
-                }
-            }
-            
-            response = self.es.search(
-                index=self.es_index,
-                body={
-                    "size": k,
-                    "query": script_query,
-                    "_source": ["case_id", "text", "chunk_id", "text_type", "case_type"]
-                }
-            )
-            
-            # Process results
-            results = []
-            for hit in response["hits"]["hits"]:
-                results.append({
-                    "case_id": hit["_source"]["case_id"],
-                    "score": hit["_score"],
-                    "text": hit["_source"]["text"],
-                    "chunk_id": hit["_source"]["chunk_id"],
-                    "text_type": hit["_source"]["text_type"],
-                    "case_type": hit["_source"].get("case_type", "")  # Get case_type if available
-                })
-            
-            # If no results found with the exact case type, try a more generic search
-            if not results:
-                print(f"在 {query_case_type} 類別中無相符結果，嘗試通用搜索...")
-                # Use original search without case_type filter
-                script_query = {
-                    "script_score": {
-                        "query": {"term": {"text_type": search_type}},
-                        "script": {
-                            "source": "cosineSimilarity(params.query_vector, 'embedding') + 1.0",
-                            "params": {"query_vector": query_embedding.tolist()}
-                        }
-                    }
-                }
-                
-                response = self.es.search(
-                    index=self.es_index,
-                    body={
-                        "size": k,
-                        "query": script_query,
-                        "_source": ["case_id", "text", "chunk_id", "text_type", "case_type"]
-                    }
-                )
-                
-                # Process results
-                for hit in response["hits"]["hits"]:
-                    results.append({
-                        "case_id": hit["_source"]["case_id"],
-                        "score": hit["_score"],
-                        "text": hit["_source"]["text"],
-                        "chunk_id": hit["_source"]["chunk_id"],
-                        "text_type": hit["_source"]["text_type"],
-                        "case_type": hit["_source"].get("case_type", "")  # Get case_type if available
-                    })
-            
-            return results
+            query_embedding = self.embedding_model.embed_texts([query_text])[0].tolist()
+
+            # text_type is a filter and case_type a boost, so one search also covers
+            # queries whose case type has fewer than k chunks
+            return self._vector_search(query_embedding, search_type, query_case_type, k, search_mode, allow_exact_fallback)
         
         except Exception as e:
             print(f"搜索 Elasticsearch 時發生錯誤: {str(e)}")
             raise
+
+    def _vector_search(self, query_vector: List[float], search_type: str, case_type: str, k: int,
+                       search_mode: Optional[str] = None, allow_exact_fallback: bool = True) -> List[Dict]:
+        """
+        Run one vector search over the chunks of search_type, boosting chunks of case_type
+
+        Scores are reported on the script_score scale (cosine + 1) in both modes,
+        without the case type boost. If the kNN request fails and allow_exact_fallback
+        is set, this call uses the exact script_score search instead; later calls
+        still try kNN.
+        """
+        search_mode = search_mode or self.search_mode
+        if search_mode == "knn":
+            try:
+                return self._knn_search(query_vector, search_type, case_type, k)
+            except Exception as e:
+                if not allow_exact_fallback:
+                    raise
+                print(f"kNN 搜索失敗，本次查詢改用精確搜索: {str(e)}")
+        return self._exact_search(query_vector, search_type, case_type, k)
+
+    def _knn_search(self, query_vector: List[float], search_type: str, case_type: str, k: int) -> List[Dict]:
+        # A top-level query next to knn would be unioned with the kNN hits and add chunks
+        # that only match the case type, so the boost is applied to the kNN candidates instead.
+        # Returning all candidates costs no extra vector comparisons.
+        num_candidates = max(k * 10, self.knn_num_candidates)
+        response = self.es.search(index=self.es_index, body={
+            "size": num_candidates,
+            "knn": {
+                "field": "embedding",
+                "query_vector": query_vector,
+                "k": num_candidates,
+                "num_candidates": num_candidates,
+                "filter": {"term": {"text_type": search_type}}
+            },
+            "_source": ["case_id", "text", "chunk_id", "text_type", "case_type"]
+        })
+        # kNN cosine scores are (1 + cosine) / 2; convert to cosine + 1 like script_score
+        results = self._parse_search_hits(response, score_scale=2.0)
+        results.sort(key=lambda result: result["score"] + (self.case_type_boost if result["case_type"] == case_type else 0.0),
+                     reverse=True)
+        return results[:k]
+
+    def _exact_search(self, query_vector: List[float], search_type: str, case_type: str, k: int) -> List[Dict]:
+        script_query = {
+            "script_score": {
+                "query": {
+                    "bool": {
+                        "filter": [{"term": {"text_type": search_type}}],
+                        # _score is case_type_boost for chunks of the query's case type, 0 otherwise
+                        "should": [{
+                            "constant_score": {
+                                "filter": {"term": {"case_type": case_type}},
+                                "boost": self.case_type_boost
+                            }
+                        }]
+                    }
+                },
+                "script": {
+                    "source": "cosineSimilarity(params.query_vector, 'embedding') + 1.0 + _score",
+                    "params": {"query_vector": query_vector}
+                }
+            }
+        }
+        
+        response = self.es.search(index=self.es_index, body={
+            "size": k,
+            "query": script_query,
+            "_source": ["case_id", "text", "chunk_id", "text_type", "case_type"]
+        })
+        results = self._parse_search_hits(response)
+        for result in results:
+            if result["case_type"] == case_type:
+                result["score"] -= self.case_type_boost
+        return results
+
+    def _parse_search_hits(self, response: Dict, score_scale: float = 1.0) -> List[Dict]:
+        results = []
+        for hit in response["hits"]["hits"]:
+            results.append({
+                "case_id": hit["_source"]["case_id"],
+                "score": hit["_score"] * score_scale,
+                "text": hit["_source"]["text"],
+                "chunk_id": hit["_source"]["chunk_id"],
+                "text_type": hit["_source"]["text_type"],
+                "case_type": hit["_source"].get("case_type", "")  # Get case_type if available
+            })
+        return results
+
+    def compare_search_recall(self, query_text: str, search_type: str, k: int, query_case_type: str) -> float:
+        """
+        Recall@k of the kNN search against the exact script_score search for one query
+
+        Returns:
+            Fraction of the exact top-k chunk ids that the kNN search also returned
+        """
+        exact = self.search_elasticsearch(query_text, search_type, k, query_case_type, search_mode="exact")
+        # No exact fallback here, otherwise a failing kNN search would report a recall of 1.0
+        approximate = self.search_elasticsearch(query_text, search_type, k, query_case_type, search_mode="knn",
+                                                allow_exact_fallback=False)
+        exact_ids = {result["chunk_id"] for result in exact}
+        if not exact_ids:
+            return 1.0
+        return len(exact_ids & {result["chunk_id"] for result in approximate}) / len(exact_ids)
     
     #FOR ts_gradio_app.py
     def get_full_text_from_elasticsearch(self, case_id):
@@ -213,21 +309,23 @@ class RetrievalSystem:
         """
         try:
             with self.neo4j_driver.session() as session:
-                # Query to get laws related to these cases
+                # Fetch laws for all cases in one round trip, keeping the order of case_ids
                 query = """
-                MATCH (c:case_node {case_id: $case_id})-[:used_law_relation]->(l:law_node)
-                RETURN l.number AS law_number, l.content AS law_content
+                UNWIND range(0, size($case_ids) - 1) AS idx
+                WITH idx, $case_ids[idx] AS case_id
+                MATCH (c:case_node {case_id: case_id})-[:used_law_relation]->(l:law_node)
+                RETURN idx, case_id, l.number AS law_number, l.content AS law_content
+                ORDER BY idx
                 """
                 
                 laws = []
-                for case_id in case_ids:
-                    result = session.run(query, case_id=case_id)
-                    for record in result:
-                        laws.append({
-                            "case_id": case_id,
-                            "law_number": record["law_number"],
-                            "law_content": record["law_content"]
-                        })
+                result = session.run(query, case_ids=list(case_ids))
+                for record in result:
+                    laws.append({
+                        "case_id": record["case_id"],
+                        "law_number": record["law_number"],
+                        "law_content": record["law_content"]
+                    })
                 
                 return laws
         
@@ -247,20 +345,22 @@ class RetrievalSystem:
         """
         try:
             with self.neo4j_driver.session() as session:
-                # Query to get conclusions related to these cases
+                # Fetch conclusions for all cases in one round trip, keeping the order of case_ids
                 query = """
-                MATCH (c:case_node {case_id: $case_id})-[:conclusion_text_relation]->(conc:conclusion_text)
-                RETURN conc.chunk AS conclusion_text
+                UNWIND range(0, size($case_ids) - 1) AS idx
+                WITH idx, $case_ids[idx] AS case_id
+                MATCH (c:case_node {case_id: case_id})-[:conclusion_text_relation]->(conc:conclusion_text)
+                RETURN idx, case_id, conc.chunk AS conclusion_text
+                ORDER BY idx
                 """
                 
                 conclusions = []
-                for case_id in case_ids:
-                    result = session.run(query, case_id=case_id)
-                    for record in result:
-                        conclusions.append({
-                            "case_id": case_id,
-                            "conclusion_text": record["conclusion_text"]
-                        })
+                result = session.run(query, case_ids=list(case_ids))
+                for record in result:
+                    conclusions.append({
+                        "case_id": record["case_id"],
+                        "conclusion_text": record["conclusion_text"]
+                    })
                 
                 return conclusions
         
@@ -268,6 +368,74 @@ class RetrievalSystem:
             print(f"從 Neo4j 獲取結論時發生錯誤: {str(e)}")
             raise
     
+    def get_reference_data(self, case_ids: List[int], law_numbers: List[str] = None) -> Dict:
+        """
+        Retrieve everything the generation pipeline needs in one Neo4j query:
+        indictment text, used laws and conclusions of every retrieved case, plus
+        the content of the requested law numbers (from the law catalog)
+        
+        Args:
+            case_ids: List of case ids (e.g. from search results)
+            law_numbers: Additional law numbers whose content is needed
+            
+        Returns:
+            Dictionary with
+                "indictments": {case_id: indictment text}
+                "laws": same list as get_laws_from_neo4j
+                "conclusions": same list as get_conclusions_from_neo4j
+                "law_contents": {law number: content} for requested and used laws
+        """
+        try:
+            with self.neo4j_driver.session() as session:
+                query = """
+                UNWIND range(0, size($case_ids) - 1) AS idx
+                WITH idx, $case_ids[idx] AS case_id
+                OPTIONAL MATCH (c:case_node {case_id: case_id})
+                WITH collect({
+                    idx: idx,
+                    case_id: case_id,
+                    case_text: c.case_text,
+                    laws: [(c)-[:used_law_relation]->(l:law_node) | {number: l.number, content: l.content}],
+                    conclusions: [(c)-[:conclusion_text_relation]->(conc:conclusion_text) | conc.chunk]
+                }) AS cases
+                RETURN cases
+                """
+                record = session.run(query, case_ids=list(case_ids)).single()
+
+            indictments, laws, conclusions, law_contents = {}, [], [], {}
+            cases = sorted(record["cases"], key=lambda x: x["idx"]) if record else []
+            for case in cases:
+                case_id = case["case_id"]
+                if case["case_text"] is not None:
+                    indictments[case_id] = case["case_text"]
+                for law in case["laws"] or []:
+                    laws.append({
+                        "case_id": case_id,
+                        "law_number": law["number"],
+                        "law_content": law["content"]
+                    })
+                    if law["content"]:
+                        law_contents[law["number"]] = law["content"]
+                for conclusion_text in case["conclusions"] or []:
+                    conclusions.append({
+                        "case_id": case_id,
+                        "conclusion_text": conclusion_text
+                    })
+
+            # Requested law contents come from the in-memory law catalog
+            law_contents.update(self.law_catalog.get_contents(law_numbers or []))
+
+            return {
+                "indictments": indictments,
+                "laws": laws,
+                "conclusions": conclusions,
+                "law_contents": law_contents
+            }
+        
+        except Exception as e:
+            print(f"從 Neo4j 獲取參考資料時發生錯誤: {str(e)}")
+            raise
+    
     def count_law_occurrences(self, laws: List[Dict]) -> Dict[str, int]:
         """
         Count law occurrences and return a dictionary with counts
@@ -318,7 +486,7 @@ class RetrievalSystem:
     
     def get_law_contents(self, law_numbers: List[str]) -> List[Dict]:
         """
-        Retrieve law contents for the given law numbers from Neo4j
+        Retrieve law contents for the given law numbers from the law catalog
         
         Args:
             law_numbers: List of law numbers
@@ -327,21 +495,12 @@ class RetrievalSystem:
             List of dictionaries containing law number and content
         """
         try:
-            with self.neo4j_driver.session() as session:
-                laws = []
-                for number in law_numbers:
-                    query = """
-                    MATCH (l:law_node {number: $number})
-                    RETURN l.number AS number, l.content AS content
-                    """
-                    result = session.run(query, number=number)
-                    for record in result:
-                        laws.append({
-                            "number": record["number"],
-                            "content": record["content"]
-                        })
-                
-                return laws
+            # Served from the in-memory law catalog, keeping the order of law_numbers
+            contents = self.law_catalog.get_contents(law_numbers)
+            return [
+                {"number": number, "content": contents[number]}
+                for number in law_numbers if number in contents
+            ]
         
         except Exception as e:
             print(f"從 Neo4j 獲取法條內容時發生錯誤: {str(e)}")
@@ -455,28 +614,38 @@ class RetrievalSystem:
             print(f"分割查詢時發生錯誤: {str(e)}")
             raise
     
-    def call_llm(self, prompt: str) -> str:
+    def call_llm(self, prompt: str, stage: Optional[str] = None) -> str:
         """
         Call LLM with the given prompt
         
         Args:
             prompt: The prompt to send to the LLM
+            stage: Name of the calling stage; responses of stages in llm_cache_stages
+                are served from and stored in the LLM response cache
             
         Returns:
             LLM response text
         """
+        use_cache = self.llm_cache is not None and stage in self.llm_cache_stages
+        if use_cache:
+            cached = self.llm_cache.get(self.llm_model, self.llm_options, prompt, stage)
+            if cached is not None:
+                return cached
+
         try:
-            response = requests.post(
-                self.llm_url,
-                json={
-                    "model": self.llm_model,
-                    "prompt": prompt,
-                    "stream": False
-                }
-            )
+            payload = {
+                "model": self.llm_model,
+                "prompt": prompt,
+                "stream": False
+            }
+            if self.llm_options:
+                payload["options"] = self.llm_options
+            # Nested pools (pipeline stages running batch law checks) share this process-wide limit
+            with self.ollama_client.generation_slots:
+                response = self.ollama_client.post(self.llm_url, payload)
             
             if response.status_code == 200:
-                return response.json()["response"].strip()
+                result = response.json()["response"].strip()
             else:
                 raise Exception(f"LLM API 錯誤: {response.status_code}, {response.text}")
         
@@ -484,6 +653,10 @@ class RetrievalSystem:
             print(f"呼叫 LLM 時發生錯誤: {str(e)}")
             raise
 
+        if use_cache:
+            self.llm_cache.put(self.llm_model, self.llm_options, prompt, result)
+        return result
+
     def get_indictment_from_neo4j(self, case_id: int) -> str:
         """
         Retrieve the full indictment text for a given case id from Neo4j
@@ -618,7 +791,7 @@ class RetrievalSystem:
             A summary of the case
         """
         prompt = get_case_summary_prompt(accident_facts, injuries)
-        return self.call_llm(prompt)
+        return self.call_llm(prompt, stage="case_summary")
 
     def check_fact_quality(self, generated_fact: str, summary: str) -> Dict[str, str]:
         """
@@ -632,7 +805,7 @@ class RetrievalSystem:
             Dictionary with check result and reason
         """
         prompt = get_fact_quality_check_prompt(generated_fact, summary)
-        result = self.call_llm(prompt)
+        result = self.call_llm(prompt, stage="fact_check")
 
         # Extract result and reason
         pass_fail = "fail"  # Default to fail
@@ -711,7 +884,7 @@ class RetrievalSystem:
         from ts_prompt_check import get_law_content_check_prompt
         
         prompt = get_law_content_check_prompt(accident_facts, injuries, law_number, law_content)
-        result = self.call_llm(prompt)
+        result = self.call_llm(prompt, stage="law_check")
         
         # Extract result and reason
         pass_fail = "fail"  # Default to fail
@@ -733,6 +906,29 @@ class RetrievalSystem:
             "reason": reason
         }
     
+    def check_laws_content(self, accident_facts: str, injuries: str, laws: Dict[str, str]) -> Dict[str, Dict[str, str]]:
+        """
+        Check several laws concurrently; each law is checked with the same prompt as check_law_content
+
+        Args:
+            accident_facts: The accident facts from user query
+            injuries: The injuries section from user query
+            laws: Dictionary mapping law number to law content
+
+        Returns:
+            Dictionary mapping law number to its check result and reason, in the order of laws
+        """
+        if not laws:
+            return {}
+
+        def check(item: Tuple[str, str]) -> Dict[str, str]:
+            law_number, law_content = item
+            return self.check_law_content(accident_facts, injuries, law_number, law_content)
+
+        with ThreadPoolExecutor(max_workers=min(self.llm_max_in_flight, len(laws))) as executor:
+            results = list(executor.map(check, laws.items()))
+        return dict(zip(laws.keys(), results))
+
     def check_compensation_part1(self, compensation_part1: str, injuries: str, compensation_facts: str, plaintiffs_info: str = "") -> Dict[str, str]:
         """
         Check if the generated compensation part 1 matches the injuries and compensation facts
@@ -747,7 +943,7 @@ class RetrievalSystem:
             Dictionary with check result and reason
         """       
         prompt = get_compensation_part1_check_prompt(compensation_part1, injuries, compensation_facts, plaintiffs_info)
-        result = self.call_llm(prompt)
+        result = self.call_llm(prompt, stage="compensation_check")
         
         # Extract result and reason
         pass_fail = "fail"  # Default to fail
@@ -913,7 +1109,7 @@ class RetrievalSystem:
             Generated facts part
         """
         prompt = get_facts_prompt(accident_facts, reference_fact_text)
-        return self.call_llm(prompt)
+        return self.call_llm(prompt, stage="facts")
         
     def generate_compensation_part1(self, injuries: str, compensation_facts: str, include_conclusion: bool, average_compensation: float, case_type: str, plaintiffs_info: str = "") -> str:
         """
@@ -946,7 +1142,7 @@ class RetrievalSystem:
             else:
                 prompt = get_compensation_prompt_part1_single_plaintiff(injuries, compensation_facts, plaintiffs_info=plaintiffs_info)
 
-        return self.call_llm(prompt)
+        return self.call_llm(prompt, stage="compensation_part1")
         
     def generate_compensation_part2(self, compensation_part1: str, plaintiffs_info: str = "") -> str:
         """
@@ -959,7 +1155,7 @@ class RetrievalSystem:
             Generated calculation tags
         """
         prompt = get_compensation_prompt_part2(compensation_part1, plaintiffs_info)
-        return self.call_llm(prompt)
+        return self.call_llm(prompt, stage="compensation_part2")
         
     def generate_compensation_part3(self, compensation_part1: str, summary_format: str, plaintiffs_info: str = "") -> str:
         """
@@ -973,7 +1169,7 @@ class RetrievalSystem:
             Generated conclusion part
         """
         prompt = get_compensation_prompt_part3(compensation_part1, summary_format, plaintiffs_info)
-        return self.call_llm(prompt)
+        return self.call_llm(prompt, stage="compensation_part3")
         
     
     # Add this method to the RetrievalSystem class in ts_retrieval_system.py
@@ -989,7 +1185,7 @@ class RetrievalSystem:
             Dictionary with check result and reason
         """
         prompt = get_calculation_tags_check_prompt(compensation_part1, compensation_part2)
-        result = self.call_llm(prompt)
+        result = self.call_llm(prompt, stage="calculation_check")
         
         # Extract result and reason
         pass_fail = "fail"  # Default to fail
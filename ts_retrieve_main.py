@@ -3,12 +3,13 @@ import sys
 import time
 import os
 import re
-from typing import List, Dict
+from typing import List, Dict, Tuple
 import traceback
 from dotenv import load_dotenv
 from ts_retrieval_system import RetrievalSystem
 from ts_prompt import get_compensation_prompt_part3
 from ts_define_case_type import get_case_type
+from ts_pipeline import PipelineRunner
 
 def extract_calculate_tags(text: str) -> Dict[str, float]:
     """
@@ -88,6 +89,251 @@ def extract_calculate_tags(text: str) -> Dict[str, float]:
     print("========== DEBUG: 提取計算標籤結束 ==========\n")
     return sums
 
+def check_laws(retrieval_system: RetrievalSystem, query_sections: Dict[str, str], keyword_laws: List[str],
+               filtered_law_numbers: List[str], law_content_map: Dict[str, str], log=print) -> List[str]:
+    """
+    Reconcile the laws of the retrieved cases with the keyword-mapped laws
+
+    Laws only found by keyword mapping are added when the LLM finds them applicable;
+    laws only found in the retrieved cases are removed when it finds them not applicable.
+
+    Returns:
+        Sorted list of the final law numbers
+    """
+    filtered_law_numbers = list(filtered_law_numbers)
+    log("\n進行法條適用性檢查...")
+    log(f"關鍵詞映射生成的法條: {keyword_laws}")
+
+    # Compare with filtered laws
+    missing_laws = [law for law in keyword_laws if law not in filtered_law_numbers]
+    extra_laws = [law for law in filtered_law_numbers if law not in keyword_laws]
+
+    log(f"可能缺少的法條: {missing_laws}")
+    log(f"可能多餘的法條: {extra_laws}")
+
+    # Check all candidate laws at once; the checks run concurrently
+    law_contents = {}
+    for law_number in missing_laws + extra_laws:
+        law_content = law_content_map.get(law_number, "")
+        if law_content:
+            law_contents[law_number] = law_content
+        else:
+            log(f"無法獲取法條 {law_number} 的內容，跳過檢查")
+
+    check_results = retrieval_system.check_laws_content(
+        query_sections['accident_facts'],
+        query_sections['injuries'],
+        law_contents
+    )
+
+    for law_number, check_result in check_results.items():
+        log(f"\n法條 {law_number} 檢查結果: {check_result['result']}")
+        log(f"原因: {check_result['reason']}")
+
+        # Add missing laws that are applicable, remove extra laws that are not
+        if law_number in missing_laws and check_result['result'] == 'pass':
+            log(f"添加法條 {law_number} 到適用法條列表")
+            filtered_law_numbers.append(law_number)
+        elif law_number in extra_laws and check_result['result'] == 'fail':
+            log(f"從適用法條列表中移除法條 {law_number}")
+            filtered_law_numbers.remove(law_number)
+
+    # Filter out duplicates and sort
+    filtered_law_numbers = sorted(list(set(filtered_law_numbers)))
+    log(f"\n最終適用法條列表: {filtered_law_numbers}")
+    return filtered_law_numbers
+
+def build_law_section(law_contents: List[Dict[str, str]]) -> str:
+    """Build the hardcoded law section from the contents of the applicable laws"""
+    law_section = "二、按「"
+    if law_contents:
+        for i, law in enumerate(law_contents):
+            content = law["content"]
+            if "：" in content:
+                content = content.split("：")[1].strip()
+            elif ":" in content:
+                content = content.split(":")[1].strip()
+
+            if i > 0:
+                law_section += "、「"
+            law_section += content
+            law_section += "」"
+
+        law_section += "民法第"
+        for i, law in enumerate(law_contents):
+            if i > 0:
+                law_section += "、第"
+            law_section += law["number"]
+            law_section += "條"
+
+        law_section += "分別定有明文。查被告因上開侵權行為，使原告受有下列損害，依前揭規定，被告應負損害賠償責任："
+    else:
+        law_section += "NO LAW"
+    return law_section
+
+def generate_fact_part(retrieval_system: RetrievalSystem, query_sections: Dict[str, str],
+                       reference_parts: Dict[str, str], log=print, max_attempts: int = 5) -> str:
+    """Generate the case summary, then the accident facts with quality checks against it"""
+    # Generate summary for quality check
+    log("\n生成案件摘要以供質量檢查...")
+    case_summary = retrieval_system.generate_case_summary(
+        query_sections['accident_facts'],
+        query_sections['injuries']
+    )
+    log(f"\n案件摘要:\n{case_summary}")
+
+    # Generate first part with LLM using loop for quality control
+    log("\n生成第一部分 (事故事實)...")
+    first_part = None
+
+    for attempt in range(1, max_attempts + 1):
+        log(f"\n正在進行第 {attempt} 次嘗試生成事故事實...")
+        log(f"參考案件事實陳述部分:\n{reference_parts['fact_text']}")
+        first_part = retrieval_system.generate_facts(
+            query_sections['accident_facts'],
+            reference_parts['fact_text']
+        )
+        log(f"\n生成的事故事實:\n{first_part}")
+        first_part = retrieval_system.clean_facts_part(first_part)
+        # Check quality
+        log("\n檢查生成質量...")
+        quality_check = retrieval_system.check_fact_quality(first_part, case_summary)
+        log(f"質量檢查結果: {quality_check['result']}")
+        log(f"原因: {quality_check['reason']}")
+
+        if quality_check['result'] == 'pass':
+            log("質量檢查通過，繼續下一步")
+            break
+
+        if attempt == max_attempts:
+            log(f"警告: 達到最大嘗試次數 ({max_attempts})，使用最後一次生成的結果")
+
+    return first_part
+
+def generate_compensation_parts(retrieval_system: RetrievalSystem, query_sections: Dict[str, str],
+                                include_conclusion: bool, average_compensation: float, case_type: str,
+                                plaintiffs_info: str, log=print) -> Tuple[str, str]:
+    """
+    Generate the compensation items, the calculation tags and the conclusion, each with quality checks
+
+    Returns:
+        (compensation_part1, compensation_part3)
+    """
+    # Generate part 1
+    log("\n生成第一部分 (損害賠償項目)...")
+    compensation_part1 = None
+
+    for part1_attempt in range(1, 6):  # max 5 attempts for part 1
+        log(f"\n正在進行第 {part1_attempt} 次嘗試生成賠償項目...")
+
+        compensation_part1 = retrieval_system.generate_compensation_part1(
+            query_sections['injuries'],
+            query_sections['compensation_facts'],
+            include_conclusion,
+            average_compensation,
+            case_type,
+            plaintiffs_info
+        )
+
+        log(f"\n生成的賠償項目:\n{compensation_part1}")
+        compensation_part1 = retrieval_system.clean_compensation_part(compensation_part1)
+
+        # Check quality
+        log("\n檢查賠償項目質量...")
+        quality_check = retrieval_system.check_compensation_part1(
+            compensation_part1,
+            query_sections['injuries'],
+            query_sections['compensation_facts'],
+            plaintiffs_info
+        )
+
+        log(f"質量檢查結果: {quality_check['result']}")
+        log(f"原因: {quality_check['reason']}")
+
+        if quality_check['result'] == 'pass':
+            log("質量檢查通過，繼續下一步")
+            break
+
+        if part1_attempt == 5:
+            log("警告: 達到最大嘗試次數 (5)，使用最後一次生成的賠償項目")
+
+    # Generate part 2
+    log("\n生成第二部分 (計算標籤)...")
+    compensation_part2 = None
+    for part2_attempt in range(1, 4):  # max 3 attempts for part 2
+        log(f"\n正在進行第 {part2_attempt} 次嘗試生成計算標籤...")
+
+        compensation_part2 = retrieval_system.generate_compensation_part2(compensation_part1, plaintiffs_info)
+
+        log(f"\n生成的計算標籤:\n{compensation_part2}")
+        calc_tags = re.findall(r'<calculate>.*?</calculate>', compensation_part2)
+        log(f"找到的計算標籤數量: {len(calc_tags)}")
+
+        # Check quality
+        log("\n檢查計算標籤質量...")
+        quality_check = retrieval_system.check_calculation_tags(compensation_part1, compensation_part2)
+        log(f"質量檢查結果: {quality_check['result']}")
+        log(f"原因: {quality_check['reason']}")
+
+        if quality_check['result'] == 'pass':
+            log("質量檢查通過，繼續下一步")
+            break
+
+        if part2_attempt == 3:
+            log("警告: 達到最大嘗試次數 (3)，使用最後一次生成的計算標籤")
+
+    # Extract and calculate sums from the tags
+    log("\n提取並計算賠償金額...")
+    compensation_sums = extract_calculate_tags(compensation_part2)
+
+    for plaintiff, amount in compensation_sums.items():
+        if plaintiff == "default":
+            log(f"總賠償金額: {amount:.2f} 元")
+        else:
+            log(f"[原告{plaintiff}]賠償金額: {amount:.2f} 元")
+
+    # Format the compensation totals for part 3
+    summary_totals = []
+    for plaintiff, amount in compensation_sums.items():
+        if plaintiff == "default":
+            summary_totals.append(f"總計{amount:.0f}元")
+        else:
+            summary_totals.append(f"應賠償[原告{plaintiff}]之損害，總計{amount:.0f}元")
+    summary_format = "；".join(summary_totals)
+
+    # Up to 5 attempts for part 3 with quality check
+    log("\n生成第三部分 (綜上所陳)...")
+    compensation_part3 = None
+
+    for part3_attempt in range(1, 6):
+        log(f"\n正在進行第 {part3_attempt} 次嘗試生成總結...")
+
+        compensation_part3 = retrieval_system.generate_compensation_part3(compensation_part1, summary_format, plaintiffs_info)
+
+        log(f"\n生成的總結:\n{compensation_part3}")
+        compensation_part3 = retrieval_system.clean_conclusion_part(compensation_part3)
+        # Extract the part after "綜上所陳" or "綜上所述"
+        summary_section = ""
+        if "綜上所陳" in compensation_part3:
+            summary_section = compensation_part3[compensation_part3.find("綜上所陳"):]
+        elif "綜上所述" in compensation_part3:
+            summary_section = compensation_part3[compensation_part3.find("綜上所述"):]
+
+        # Check if all amounts from compensation_sums appear in the summary section
+        log("\n檢查總結中是否包含所有賠償金額...")
+        check_result = retrieval_system.check_amounts_in_summary(summary_section, compensation_sums)
+        log(f"檢查結果: {check_result['result']}")
+        log(f"原因: {check_result['reason']}")
+
+        if check_result['result'] == 'pass':
+            log("檢查通過，總結中包含所有賠償金額")
+            break
+
+        if part3_attempt == 5:
+            log("警告: 達到最大嘗試次數 (5)，使用最後一次生成的總結")
+
+    return compensation_part1, compensation_part3
+
 def main():
     """Main function to run the legal document retrieval system"""
     start_time = time.time()
@@ -185,12 +431,26 @@ def main():
         case_ids = [result['case_id'] for result in search_results]
         print(f"找到的 Case IDs: {case_ids}")
         
+        # Generate laws by keyword mapping (only depends on the query, needed for the law checks below)
+        keyword_laws = retrieval_system.get_laws_by_keyword_mapping(
+            query_sections['accident_facts'], 
+            query_sections['injuries'],
+            query_sections['compensation_facts']
+        )
+        
+        # Fetch indictments, used laws, conclusions and law contents in one Neo4j query
+        print("\n從 Neo4j 獲取參考案件資料...")
+        reference_data = retrieval_system.get_reference_data(case_ids, keyword_laws)
+        law_content_map = reference_data["law_contents"]
+        
         # Get the most similar case (first result)
         most_similar_case_id = search_results[0]['case_id']
         print(f"\n獲取最相似案件 (Case ID: {most_similar_case_id}) 的完整起訴狀...")
         
-        # Get full indictment text from Neo4j for the most similar case
-        reference_indictment = retrieval_system.get_indictment_from_neo4j(most_similar_case_id)
+        # Get full indictment text for the most similar case
+        reference_indictment = reference_data["indictments"].get(most_similar_case_id, "")
+        if not reference_indictment:
+            print(f"警告: 在 Neo4j 中找不到案件 {most_similar_case_id} 的起訴狀文本")
         
         if not reference_indictment:
             print("警告: 無法獲取參考案件的起訴狀，將使用標準生成流程")
@@ -206,9 +466,8 @@ def main():
             reference_parts = retrieval_system.split_indictment_text(reference_indictment)
             print("參考案件分割完成")
         
-        # Get laws from Neo4j
-        print("\n從 Neo4j 獲取相關法條...")
-        laws = retrieval_system.get_laws_from_neo4j(case_ids)
+        # Get laws of the retrieved cases
+        laws = reference_data["laws"]
         
         if not laws:
             print("警告: 未找到相關法條")
@@ -234,113 +493,12 @@ def main():
         filtered_law_numbers = retrieval_system.filter_laws_by_occurrence(law_counts, j)
         print(f"\n符合出現次數 >= {j} 的法條: {filtered_law_numbers}")
         
-        print("\n進行法條適用性檢查...")
-        # Generate laws by keyword mapping
-        print("使用關鍵詞映射生成可能適用的法條...")
-        keyword_laws = retrieval_system.get_laws_by_keyword_mapping(
-            query_sections['accident_facts'], 
-            query_sections['injuries'],
-            query_sections['compensation_facts']
-        )
-        print(f"關鍵詞映射生成的法條: {keyword_laws}")
-
-        # Compare with filtered laws
-        missing_laws = [law for law in keyword_laws if law not in filtered_law_numbers]
-        extra_laws = [law for law in filtered_law_numbers if law not in keyword_laws]
-
-        print(f"可能缺少的法條: {missing_laws}")
-        print(f"可能多餘的法條: {extra_laws}")
-
-        # Check each missing law
-        for law_number in missing_laws:
-            print(f"\n檢查缺少的法條 {law_number}...")
-            # Get law content from Neo4j
-            law_content = ""
-            with retrieval_system.neo4j_driver.session() as session:
-                query = """
-                MATCH (l:law_node {number: $number})
-                RETURN l.content AS content
-                """
-                result = session.run(query, number=law_number)
-                record = result.single()
-                if record and record.get("content"):
-                    law_content = record["content"]
-            
-            if not law_content:
-                print(f"無法獲取法條 {law_number} 的內容，跳過檢查")
-                continue
-            
-            # Check if the law is applicable
-            check_result = retrieval_system.check_law_content(
-                query_sections['accident_facts'],
-                query_sections['injuries'],
-                law_number,
-                law_content
-            )
-            
-            print(f"法條 {law_number} 檢查結果: {check_result['result']}")
-            print(f"原因: {check_result['reason']}")
-            
-            # Add to filtered laws if applicable
-            if check_result['result'] == 'pass':
-                print(f"添加法條 {law_number} 到適用法條列表")
-                filtered_law_numbers.append(law_number)
-                # Sort the list again
-                filtered_law_numbers = sorted(filtered_law_numbers)
-
-        # Check each extra law
-        for law_number in extra_laws:
-            print(f"\n檢查可能多餘的法條 {law_number}...")
-            # Get law content
-            law_content = ""
-            with retrieval_system.neo4j_driver.session() as session:
-                query = """
-                MATCH (l:law_node {number: $number})
-                RETURN l.content AS content
-                """
-                result = session.run(query, number=law_number)
-                record = result.single()
-                if record and record.get("content"):
-                    law_content = record["content"]
-            
-            if not law_content:
-                print(f"無法獲取法條 {law_number} 的內容，跳過檢查")
-                continue
-            
-            # Check if the law is applicable
-            check_result = retrieval_system.check_law_content(
-                query_sections['accident_facts'],
-                query_sections['injuries'],
-                law_number,
-                law_content
-            )
-            
-            print(f"法條 {law_number} 檢查結果: {check_result['result']}")
-            print(f"原因: {check_result['reason']}")
-            
-            # Remove from filtered laws if not applicable
-            if check_result['result'] == 'fail':
-                print(f"從適用法條列表中移除法條 {law_number}")
-                filtered_law_numbers.remove(law_number)
-        # Filter out duplicates and sort
-        filtered_law_numbers = sorted(list(set(filtered_law_numbers)))
-        print(f"\n最終適用法條列表: {filtered_law_numbers}")
-
-        # Get law contents
-        law_contents = [] 
-        if filtered_law_numbers:
-            law_contents = retrieval_system.get_law_contents(filtered_law_numbers)
-            print("\n獲取到的法條內容:")
-            for law in law_contents:
-                print(f"法條 {law['number']}: {law['content']}")
-        
         # Get conclusions if requested
         conclusions = []
         average_compensation = 0.0
         
         if include_conclusion:
-            print("\n從 Neo4j 獲取結論文本...")
-            conclusions = retrieval_system.get_conclusions_from_neo4j(case_ids)
+            conclusions = reference_data["conclusions"]
             
             if not conclusions:
                 print("警告: 未找到結論文本")
@@ -366,212 +524,37 @@ def main():
         if not query_sections["compensation_facts"]:
             print("警告: 無法正確分割查詢中的賠償事實部分")
         
-        # Generate summary for quality check
-        print("\n生成案件摘要以供質量檢查...")
-        case_summary = retrieval_system.generate_case_summary(
-            query_sections['accident_facts'], 
-            query_sections['injuries']
-        )
-        print("\n案件摘要:")
-        print(case_summary)
-        
-        # Generate first part with LLM using loop for quality control
-        print("\n生成第一部分 (事故事實)...")
-        max_attempts = 5
-        first_part = None
-        
-        for attempt in range(1, max_attempts + 1):
-            print(f"\n正在進行第 {attempt} 次嘗試生成事故事實...")
-            print(f"query_sections['accident_facts']: {query_sections['accident_facts']}")
-            print(f"reference_parts['fact_text']: {reference_parts['fact_text']}")
-            first_part = retrieval_system.generate_facts(
-                query_sections['accident_facts'],
-                reference_parts['fact_text']
-            )
-            print("\n生成的事故事實:")
-            print(first_part)
-            first_part = retrieval_system.clean_facts_part(first_part)
-            print("\n清理後的fact:")
-            print(first_part)
-            # Check quality
-            print("\n檢查生成質量...")
-            quality_check = retrieval_system.check_fact_quality(first_part, case_summary)
-            print(f"質量檢查結果: {quality_check['result']}")
-            print(f"原因: {quality_check['reason']}")
-            
-            if quality_check['result'] == 'pass':
-                print("質量檢查通過，繼續下一步")
-                break
-                
-            if attempt == max_attempts:
-                print(f"警告: 達到最大嘗試次數 ({max_attempts})，使用最後一次生成的結果")
-        
-        # Generate hardcoded law section
-        law_section = "二、按「"
-        if law_contents:
-            for i, law in enumerate(law_contents):
-                content = law["content"]
-                if "：" in content:
-                    content = content.split("：")[1].strip()
-                elif ":" in content:
-                    content = content.split(":")[1].strip()
-                
-                if i > 0:
-                    law_section += "、「"
-                law_section += content
-                law_section += "」"
-            
-            law_section += "民法第"
-            for i, law in enumerate(law_contents):
-                if i > 0:
-                    law_section += "、第"
-                law_section += law["number"]
-                law_section += "條"
-            
-            law_section += "分別定有明文。查被告因上開侵權行為，使原告受有下列損害，依前揭規定，被告應負損害賠償責任："
-        else:
-            law_section += "NO LAW"
-        
-        # Compensation generation with unified loop approach
-        print("\n生成賠償部分...")
-        
-        compensation_part1 = None
-        compensation_part2 = None
-        compensation_part3 = None
-        compensation_sums = None
-        final_compensation = None     
-        
-        # Generate part 1
-        print("\n生成第一部分 (損害賠償項目)...")
-        compensation_part1 = None
-        part1_success = False
-
-        for part1_attempt in range(1, 6):  # max 3 attempts for part 1
-            print(f"\n正在進行第 {part1_attempt} 次嘗試生成賠償項目...")
-            
-            compensation_part1 = retrieval_system.generate_compensation_part1(
-                query_sections['injuries'],
-                query_sections['compensation_facts'],
-                include_conclusion,
-                average_compensation,
-                case_type,
-                plaintiffs_info
-            )
-            
-            print("\n========== DEBUG: 第一部分賠償生成結果 ==========")
-            print(f"compensation_part1: {compensation_part1}")
-            print("========== DEBUG 結束 ==========\n")
-            
-            compensation_part1 = retrieval_system.clean_compensation_part(compensation_part1)
-            
-            # Check quality
-            print("\n檢查賠償項目質量...")
-            quality_check = retrieval_system.check_compensation_part1(
-                compensation_part1, 
-                query_sections['injuries'],
-                query_sections['compensation_facts'],
-                plaintiffs_info
+        def resolve_law_section() -> str:
+            final_law_numbers = check_laws(
+                retrieval_system, query_sections, keyword_laws, filtered_law_numbers, law_content_map
             )
-            
-            print(f"質量檢查結果: {quality_check['result']}")
-            print(f"原因: {quality_check['reason']}")
-            
-            if quality_check['result'] == 'pass':
-                print("質量檢查通過，繼續下一步")
-                part1_success = True
-                break
-                
-            if part1_attempt == 3:
-                print(f"警告: 達到最大嘗試次數 (3)，使用最後一次生成的賠償項目")
-        
-        # Generate part 2
-        print("\n生成第二部分 (計算標籤)...")
-        compensation_part2 = None
-        part2_success = False
-        for part2_attempt in range(1, 4):  # max 3 attempts for part 2
-            print(f"\n正在進行第 {part2_attempt} 次嘗試生成計算標籤...")
-            
-            compensation_part2 = retrieval_system.generate_compensation_part2(compensation_part1, plaintiffs_info)
-            
-            print("\n========== DEBUG: 計算標籤生成結果 ==========")
-            print(compensation_part2)
-            calc_tags = re.findall(r'<calculate>.*?</calculate>', compensation_part2)
-            print(f"找到的計算標籤數量: {len(calc_tags)}")
-            for i, tag in enumerate(calc_tags):
-                print(f"標籤 {i+1}: {tag}")
-            print("========== DEBUG 結束 ==========\n")
-            
-            # Check quality
-            print("\n檢查計算標籤質量...")
-            quality_check = retrieval_system.check_calculation_tags(compensation_part1, compensation_part2)
-            print(f"質量檢查結果: {quality_check['result']}")
-            print(f"原因: {quality_check['reason']}")
-            
-            if quality_check['result'] == 'pass':
-                print("質量檢查通過，繼續下一步")
-                part2_success = True
-                break
-                
-            if part2_attempt == 3:
-                print(f"警告: 達到最大嘗試次數 (3)，使用最後一次生成的計算標籤")
-        # Continue with extracting and calculating sums from the tags
-        # Extract and calculate sums from the tags
-        print("\n提取並計算賠償金額...")
-        compensation_sums = extract_calculate_tags(compensation_part2)
-        
-        # Print extracted sums
-        for plaintiff, amount in compensation_sums.items():
-            if plaintiff == "default":
-                print(f"總賠償金額: {amount:.2f} 元")
-            else:
-                print(f"[原告{plaintiff}]賠償金額: {amount:.2f} 元")
-        
-        # Format the compensation totals for part 3
-        summary_totals = []
-        for plaintiff, amount in compensation_sums.items():
-            if plaintiff == "default":
-                summary_totals.append(f"總計{amount:.0f}元")
-            else:
-                summary_totals.append(f"應賠償[原告{plaintiff}]之損害，總計{amount:.0f}元")
-        summary_format = "；".join(summary_totals)
-        
-        # Inner loop - up to 3 attempts for part 3 with quality check
-        print("\n生成第三部分 (綜上所陳)...")
-        compensation_part3 = None
-        part3_success = False
-        
-        for part3_attempt in range(1, 6):  # max 6 attempts for part 3
-            print(f"\n正在進行第 {part3_attempt} 次嘗試生成總結...")
-            
-            compensation_part3 = retrieval_system.generate_compensation_part3(compensation_part1, summary_format, plaintiffs_info)
-            
-            print(f"COMPENSATION_PART3 BEFORE QUALITY CHECK AND BEFORE CLEAN:\n {compensation_part3}")
-            compensation_part3 = retrieval_system.clean_conclusion_part(compensation_part3)
-            # Extract the part after "綜上所陳" or "綜上所述"
-            summary_section = ""
-            if "綜上所陳" in compensation_part3:
-                summary_section = compensation_part3[compensation_part3.find("綜上所陳"):]
-            elif "綜上所述" in compensation_part3:
-                summary_section = compensation_part3[compensation_part3.find("綜上所述"):]
-            
-            # Check if all amounts from compensation_sums appear in the summary section
-            print("\n檢查總結中是否包含所有賠償金額...")
-            check_result = retrieval_system.check_amounts_in_summary(summary_section, compensation_sums)
-            print(f"檢查結果: {check_result['result']}")
-            print(f"原因: {check_result['reason']}")
-            
-            if check_result['result'] == 'pass':
-                print("檢查通過，總結中包含所有賠償金額")
-                part3_success = True
-                break
-            
-            if part3_attempt == 5: # Changed from 3 to 5 to match the loop range
-                print(f"警告: 達到最大嘗試次數 (5)，使用最後一次生成的總結")
+            law_contents = [
+                {"number": number, "content": law_content_map[number]}
+                for number in final_law_numbers if number in law_content_map
+            ]
+            if law_contents:
+                print("\n獲取到的法條內容:")
+                for law in law_contents:
+                    print(f"法條 {law['number']}: {law['content']}")
+            return build_law_section(law_contents)
+        
+        # The facts, the law checks and the compensation do not depend on each other;
+        # run them concurrently and join where the indictment is assembled
+        print("\n並行生成事故事實、法條與賠償部分...")
+        with PipelineRunner() as runner:
+            runner.submit("facts", generate_fact_part, retrieval_system, query_sections, reference_parts)
+            runner.submit("laws", resolve_law_section)
+            runner.submit("compensation", generate_compensation_parts, retrieval_system, query_sections,
+                          include_conclusion, average_compensation, case_type, plaintiffs_info)
+            results = runner.results()
+        
+        first_part = results["facts"]
+        law_section = results["laws"]
+        compensation_part1, compensation_part3 = results["compensation"]
         
         # Combine parts for final check
         final_compensation = f"{compensation_part1}\n\n{compensation_part3}"
         
-        
         # Combine all parts
         final_response = f"{first_part}\n\n{law_section}\n\n{final_compensation}"
         final_response = retrieval_system.remove_special_chars(final_response)
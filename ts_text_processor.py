@@ -1,8 +1,18 @@
 # ts_text_processor.py
 import re
-import requests
-from typing import List, Dict
+import json
+from typing import List, Dict, Optional
 from sklearn.metrics.pairwise import cosine_similarity
+from ts_ollama_client import get_ollama_client
+
+CHUNK_CLASSIFY_INSTRUCTIONS = """將以下文本分類成3類中的一類: 
+                                        'fact' (若文本是描述事故經過或事實背景), 
+                                        'injuries' (若文本描述受傷情況或醫療後果), 
+                                        'compensation' (若文本涉及賠償請求、金錢損失或相關事宜).
+                                        範例文本：’一、事故發生緣由: 被告丙○○於96年6月30日晚間9時20分許，騎乘牌照號碼TUF-983號輕型機車，沿彰化縣二林鎮○○路由東往西行駛，途經彰化縣二林鎮○○里○○路○○路口時，欲左轉南安路口時，本應注意車前狀況，隨時採取必要之安全措施，且應遵守車輛同為幹線道或支線道者，轉彎車應暫停讓直行車先行之交通規則，而依當時之情形，天候為晴，夜間有照明，視距良好，且柏油路面乾燥，無缺陷及障礙物，並無不能注意之情形，竟疏未注意貿然左轉，適有原告騎乘牌照號碼BLB-756號重型機車，沿斗苑路由西往東行駛，途經上開路口閃避不及，兩車因而相撞。二、原告受傷情形: 原告因本件車禍受有頭部外傷合併腦內血腫之傷害，經財團法人彰化基督教醫院緊急實施開顱清除血塊及顱內監測等手術，始暫時挽救垂危之生命，但仍留有言語不清、無法思考，記憶仍嚴重退化等後遺症，經診斷原告患有⑴外傷性蜘蛛網膜下腔出血及硬網膜下血腫⑵延遲性左側顱內出血⑶疑脾臟挫傷。三、請求賠償的事實根據: 原告因本件車禍受傷住院期間支出醫療費用47,764元，有相關醫療收據可以證明。原告於車禍前每月平均收入為31,000元，有薪資憑單及扣繳憑單可以證明。因本件車禍造成顱內重大手術，需要長期休養才能完全康復投入職場工作，請求7個月不能工作之損失共計21萬元。’
+                                        例子1：‘被告丙○○於96年6月30日晚間9時20分許，騎乘牌照號碼TUF-983號輕型機車，沿彰化縣二林鎮○○路由東往西行駛，途經彰化縣二林鎮○○里○○路○○路口時，欲左轉南安路口時，本應注意車前狀況，隨時採取必要之安全措施，且應遵守車輛同為幹線道或支線道者，轉彎車應暫停讓直行車先行之交通規則，而依當時之情形，天候為晴，夜間有照明，視距良好，且柏油路面乾燥，無缺陷及障礙物，並無不能注意之情形，竟疏未注意貿然左轉，適有原告騎乘牌照號碼BLB-756號重型機車，沿斗苑路由西往東行駛，途經上開路口閃避不及，兩車因而相撞。’ 是 'fact'
+                                        例子2：‘原告因本件車禍受有頭部外傷合併腦內血腫之傷害，經財團法人彰化基督教醫院緊急實施開顱清除血塊及顱內監測等手術，始暫時挽救垂危之生命，但仍留有言語不清、無法思考，記憶仍嚴重退化等後遺症，經診斷原告患有⑴外傷性蜘蛛網膜下腔出血及硬網膜下血腫⑵延遲性左側顱內出血⑶疑脾臟挫傷。’ 是 'injuries'
+                                        例子3：‘原告因本件車禍受傷住院期間支出醫療費用47,764元，有相關醫療收據可以證明。原告於車禍前每月平均收入為31,000元，有薪資憑單及扣繳憑單可以證明。因本件車禍造成顱內重大手術，需要長期休養才能完全康復投入職場工作，請求7個月不能工作之損失共計21萬元。’ 是 'compensation'"""
 
 class TextProcessor:
     @staticmethod
@@ -18,17 +28,10 @@ class TextProcessor:
     def classify_chunk(chunk: str) -> str:
         try:
             # Call Ollama with llama3.1 model
-            response = requests.post('http://localhost:11434/api/generate', 
-                                   json={
+            response = get_ollama_client().post('/api/generate',
+                                   {
                                        "model": "kenneth85/llama-3-taiwan:8b-instruct-dpo",
-                                       "prompt": f"""將以下文本分類成3類中的一類: 
-                                        'fact' (若文本是描述事故經過或事實背景), 
-                                        'injuries' (若文本描述受傷情況或醫療後果), 
-                                        'compensation' (若文本涉及賠償請求、金錢損失或相關事宜).
-                                        範例文本：’一、事故發生緣由: 被告丙○○於96年6月30日晚間9時20分許，騎乘牌照號碼TUF-983號輕型機車，沿彰化縣二林鎮○○路由東往西行駛，途經彰化縣二林鎮○○里○○路○○路口時，欲左轉南安路口時，本應注意車前狀況，隨時採取必要之安全措施，且應遵守車輛同為幹線道或支線道者，轉彎車應暫停讓直行車先行之交通規則，而依當時之情形，天候為晴，夜間有照明，視距良好，且柏油路面乾燥，無缺陷及障礙物，並無不能注意之情形，竟疏未注意貿然左轉，適有原告騎乘牌照號碼BLB-756號重型機車，沿斗苑路由西往東行駛，途經上開路口閃避不及，兩車因而相撞。二、原告受傷情形: 原告因本件車禍受有頭部外傷合併腦內血腫之傷害，經財團法人彰化基督教醫院緊急實施開顱清除血塊及顱內監測等手術，始暫時挽救垂危之生命，但仍留有言語不清、無法思考，記憶仍嚴重退化等後遺症，經診斷原告患有⑴外傷性蜘蛛網膜下腔出血及硬網膜下血腫⑵延遲性左側顱內出血⑶疑脾臟挫傷。三、請求賠償的事實根據: 原告因本件車禍受傷住院期間支出醫療費用47,764元，有相關醫療收據可以證明。原告於車禍前每月平均收入為31,000元，有薪資憑單及扣繳憑單可以證明。因本件車禍造成顱內重大手術，需要長期休養才能完全康復投入職場工作，請求7個月不能工作之損失共計21萬元。’
-                                        例子1：‘被告丙○○於96年6月30日晚間9時20分許，騎乘牌照號碼TUF-983號輕型機車，沿彰化縣二林鎮○○路由東往西行駛，途經彰化縣二林鎮○○里○○路○○路口時，欲左轉南安路口時，本應注意車前狀況，隨時採取必要之安全措施，且應遵守車輛同為幹線道或支線道者，轉彎車應暫停讓直行車先行之交通規則，而依當時之情形，天候為晴，夜間有照明，視距良好，且柏油路面乾燥，無缺陷及障礙物，並無不能注意之情形，竟疏未注意貿然左轉，適有原告騎乘牌照號碼BLB-756號重型機車，沿斗苑路由西往東行駛，途經上開路口閃避不及，兩車因而相撞。’ 是 'fact'
-                                        例子2：‘原告因本件車禍受有頭部外傷合併腦內血腫之傷害，經財團法人彰化基督教醫院緊急實施開顱清除血塊及顱內監測等手術，始暫時挽救垂危之生命，但仍留有言語不清、無法思考，記憶仍嚴重退化等後遺症，經診斷原告患有⑴外傷性蜘蛛網膜下腔出血及硬網膜下血腫⑵延遲性左側顱內出血⑶疑脾臟挫傷。’ 是 'injuries'
-                                        例子3：‘原告因本件車禍受傷住院期間支出醫療費用47,764元，有相關醫療收據可以證明。原告於車禍前每月平均收入為31,000元，有薪資憑單及扣繳憑單可以證明。因本件車禍造成顱內重大手術，需要長期休養才能完全康復投入職場工作，請求7個月不能工作之損失共計21萬元。’ 是 'compensation'
+                                       "prompt": f"""{CHUNK_CLASSIFY_INSTRUCTIONS}
 
                                        Text: {chunk}
                                        
@@ -55,4 +58,74 @@ class TextProcessor:
                 
         except Exception as e:
             print(f"Exception in classify_chunk: {str(e)}")
-            return 'fact'
\ No newline at end of file
+            return 'fact'
+
+    @staticmethod
+    def _parse_chunk_label(result: str) -> Optional[str]:
+        result = str(result).strip().lower()
+        for label in ('fact', 'injuries', 'compensation'):
+            if label in result:
+                return label
+        return None
+
+    @staticmethod
+    def classify_chunks(chunks: List[str]) -> List[str]:
+        """
+        Classify all chunks of a case with a single LLM call
+
+        The chunks are sent numbered in one prompt and the model answers in
+        Ollama JSON mode. Entries that cannot be parsed fall back to
+        classify_chunk one by one.
+
+        Args:
+            chunks: Chunks of one case
+
+        Returns:
+            List of labels in the same order as chunks
+        """
+        if not chunks:
+            return []
+        if len(chunks) == 1:
+            return [TextProcessor.classify_chunk(chunks[0])]
+
+        labels: List[Optional[str]] = [None] * len(chunks)
+        numbered_chunks = "\n".join(f"{i + 1}. {chunk}" for i, chunk in enumerate(chunks))
+
+        try:
+            response = get_ollama_client().post('/api/generate',
+                                   {
+                                       "model": "kenneth85/llama-3-taiwan:8b-instruct-dpo",
+                                       "prompt": f"""{CHUNK_CLASSIFY_INSTRUCTIONS}
+
+                                       以下有 {len(chunks)} 段編號的文本，請分別分類:
+                                       {numbered_chunks}
+
+                                       Respond in JSON only, mapping each number to one word - either 'fact', 'injuries', or 'compensation'.
+                                       Example: {{"1": "fact", "2": "injuries", "3": "compensation"}}""",
+                                       "format": "json",
+                                       "stream": False
+                                   })
+
+            if response.status_code == 200:
+                parsed = json.loads(response.json()['response'])
+                if isinstance(parsed, list):
+                    parsed = {str(i + 1): value for i, value in enumerate(parsed)}
+                if isinstance(parsed, dict):
+                    for i in range(len(chunks)):
+                        value = parsed.get(str(i + 1))
+                        if value is not None:
+                            labels[i] = TextProcessor._parse_chunk_label(value)
+            else:
+                print(f"Error calling Ollama API: {response.status_code}")
+
+        except Exception as e:
+            print(f"Exception in classify_chunks: {str(e)}")
+
+        # Fall back to the per-chunk path only for entries that could not be parsed
+        unresolved = [i for i, label in enumerate(labels) if label is None]
+        if unresolved:
+            print(f"批次分類無法解析 {len(unresolved)}/{len(chunks)} 個 chunk，改用逐一分類")
+        for i in unresolved:
+            labels[i] = TextProcessor.classify_chunk(chunks[i])
+
+        return labels
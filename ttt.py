@@ -1,11 +1,13 @@
 # ts_gradio_app.py
 import gradio as gr
 import re
+import threading
 import time
 import traceback
 from queue import Queue
 import numpy as np
-from ts_retrieve_main import RetrievalSystem, get_case_type
+from ts_retrieve_main import RetrievalSystem, get_case_type, check_laws, build_law_section, generate_fact_part, generate_compensation_parts
+from ts_pipeline import PipelineRunner
 
 # Create global variables to store search results between steps
 search_results_global = []
@@ -15,13 +17,30 @@ plaintiffs_info_global = ""
 case_info_global = ""
 llm_model_options = ["gemma3:27b", "kenneth85/llama-3-taiwan:8b-instruct-dpo"]
 
+# One retrieval system per LLM model, shared by all requests, so connections, the
+# law catalog and the embedding cache are set up once instead of on every request
+retrieval_systems = {}
+retrieval_systems_lock = threading.Lock()
+
+def get_retrieval_system(model_name=llm_model_options[0]):
+    """Return the shared RetrievalSystem for a model, creating it on first use"""
+    with retrieval_systems_lock:
+        if model_name not in retrieval_systems:
+            retrieval_systems[model_name] = RetrievalSystem(modelname=model_name)
+        return retrieval_systems[model_name]
+
+def close_retrieval_systems():
+    with retrieval_systems_lock:
+        for retrieval_system in retrieval_systems.values():
+            retrieval_system.close()
+        retrieval_systems.clear()
+
 def search_cases(user_query, k_value, model_name):
     """First step: Process the user query to search for similar cases"""
     global search_results_global, query_sections_global, case_type_global, plaintiffs_info_global, case_info_global
     
     try:
-        # Initialize retrieval system
-        retrieval_system = RetrievalSystem(modelname=model_name)
+        retrieval_system = get_retrieval_system(model_name)
         progress_text = "初始化檢索系統...\n"
         reference_options = ["默認（最相似案件）"]
         # Split user query
@@ -43,7 +62,6 @@ def search_cases(user_query, k_value, model_name):
         
         if not search_results:
             progress_text += "未找到相符的文檔，請嘗試修改查詢或減少 Top-K 數量\n"
-            retrieval_system.close()
             return progress_text, case_type, "未找到相符的文檔", gr.update(visible=True, choices=reference_options)
         
         # Store search results for later use
@@ -69,8 +87,6 @@ def search_cases(user_query, k_value, model_name):
         reference_options = [f"{i+1}: Case ID {result['case_id']}" for i, result in enumerate(search_results)]
         reference_options.insert(0, "默認（最相似案件）")
         
-        retrieval_system.close()
-        
         return progress_text, case_type, top_k_text, gr.update(visible=True, choices=reference_options)
     
     except Exception as e:
@@ -94,9 +110,8 @@ def generate_document(reference_choice, model_name):
         return
     
     try:
-        # Initialize retrieval system
         from ts_retrieve_main import extract_calculate_tags
-        retrieval_system = RetrievalSystem(modelname=model_name)
+        retrieval_system = get_retrieval_system(model_name)
         # Determine reference case ID from dropdown selection
         if reference_choice == "默認（最相似案件）" or not reference_choice:
             most_similar_case_id = search_results_global[0]['case_id']
@@ -125,8 +140,18 @@ def generate_document(reference_choice, model_name):
             ]
         yield current_state()
         
-        # Get full indictment text from Neo4j for the reference case
-        reference_indictment = retrieval_system.get_indictment_from_neo4j(most_similar_case_id)
+        # Fetch indictments, used laws, conclusions and law contents in one Neo4j query
+        case_ids = [result['case_id'] for result in search_results_global]
+        keyword_laws = retrieval_system.get_laws_by_keyword_mapping(
+            query_sections_global['accident_facts'], 
+            query_sections_global['injuries'],
+            query_sections_global['compensation_facts']
+        )
+        reference_data = retrieval_system.get_reference_data(case_ids, keyword_laws)
+        law_content_map = reference_data["law_contents"]
+        
+        # Get full indictment text for the reference case
+        reference_indictment = reference_data["indictments"].get(most_similar_case_id, "")
         
         if not reference_indictment:
             progress_text += "警告: 無法獲取參考案件的起訴狀，將使用標準生成流程\n"
@@ -144,13 +169,8 @@ def generate_document(reference_choice, model_name):
         
         yield current_state()
         
-        # Extract case IDs and get laws from Neo4j
-        case_ids = [result['case_id'] for result in search_results_global]
-        progress_text += f"從 Neo4j 獲取相關法條...\n"
-        
-        yield current_state()
-        
-        laws = retrieval_system.get_laws_from_neo4j(case_ids)
+        # Get laws of the retrieved cases
+        laws = reference_data["laws"]
         
         if not laws:
             progress_text += "警告: 未找到相關法條\n"
@@ -174,109 +194,8 @@ def generate_document(reference_choice, model_name):
         progress_text += f"符合出現次數 >= {j} 的法條: {filtered_law_numbers}\n"
         
         yield current_state()
-        # Add law check logic from original code
-        progress_text += "\n進行法條適用性檢查...\n"
-        progress_text += "使用關鍵詞映射生成可能適用的法條...\n"
-        yield current_state()
-        keyword_laws = retrieval_system.get_laws_by_keyword_mapping(
-            query_sections_global['accident_facts'], 
-            query_sections_global['injuries'],
-            query_sections_global['compensation_facts']
-        )
-        progress_text += f"關鍵詞映射生成的法條: {keyword_laws}\n"
-        # Compare with filtered laws
-        missing_laws = [law for law in keyword_laws if law not in filtered_law_numbers]
-        extra_laws = [law for law in filtered_law_numbers if law not in keyword_laws]
-        progress_text += f"可能缺少的法條: {missing_laws}\n"
-        progress_text += f"可能多餘的法條: {extra_laws}\n"
-        yield current_state()
-        # Check each missing law
-        for law_number in missing_laws:
-            progress_text += f"\n檢查缺少的法條 {law_number}...\n"
-            
-            yield current_state()
-            
-            # Get law content from Neo4j
-            law_content = ""
-            with retrieval_system.neo4j_driver.session() as session:
-                query = """
-                MATCH (l:law_node {number: $number})
-                RETURN l.content AS content
-                """
-                result = session.run(query, number=law_number)
-                record = result.single()
-                if record and record.get("content"):
-                    law_content = record["content"]
-            
-            if not law_content:
-                progress_text += f"無法獲取法條 {law_number} 的內容，跳過檢查\n"
-                continue
-            
-            # Check if the law is applicable
-            check_result = retrieval_system.check_law_content(
-                query_sections_global['accident_facts'],
-                query_sections_global['injuries'],
-                law_number,
-                law_content
-            )
-            
-            progress_text += f"法條 {law_number} 檢查結果: {check_result['result']}\n"
-            progress_text += f"原因: {check_result['reason']}\n"
-            
-            # Add to filtered laws if applicable
-            if check_result['result'] == 'pass':
-                progress_text += f"添加法條 {law_number} 到適用法條列表\n"
-                filtered_law_numbers.append(law_number)
-                # Sort the list again
-                filtered_law_numbers = sorted(filtered_law_numbers)
-        # Check each extra law
-        for law_number in extra_laws:
-            progress_text += f"\n檢查可能多餘的法條 {law_number}...\n"
-            
-            yield current_state()
-            
-            # Get law content
-            law_content = ""
-            with retrieval_system.neo4j_driver.session() as session:
-                query = """
-                MATCH (l:law_node {number: $number})
-                RETURN l.content AS content
-                """
-                result = session.run(query, number=law_number)
-                record = result.single()
-                if record and record.get("content"):
-                    law_content = record["content"]
-            
-            if not law_content:
-                progress_text += f"無法獲取法條 {law_number} 的內容，跳過檢查\n"
-                continue
-            
-            # Check if the law is applicable
-            check_result = retrieval_system.check_law_content(
-                query_sections_global['accident_facts'],
-                query_sections_global['injuries'],
-                law_number,
-                law_content
-            )
-            
-            progress_text += f"法條 {law_number} 檢查結果: {check_result['result']}\n"
-            progress_text += f"原因: {check_result['reason']}\n"
-            
-            # Remove from filtered laws if not applicable
-            if check_result['result'] == 'fail':
-                progress_text += f"從適用法條列表中移除法條 {law_number}\n"
-                filtered_law_numbers.remove(law_number)
-        # Filter out duplicates and sort
-        filtered_law_numbers = sorted(list(set(filtered_law_numbers)))
-        progress_text += f"\n最終適用法條列表: {filtered_law_numbers}\n\n"
-        yield current_state()
-        
         # Get conclusions and calculate compensation amounts
-        progress_text += "從 Neo4j 獲取結論文本...\n"
-        
-        yield current_state()
-        
-        conclusions = retrieval_system.get_conclusions_from_neo4j(case_ids)
+        conclusions = reference_data["conclusions"]
         
         compensation_text = "賠償金額:\n"
         average_compensation = 0.0
@@ -301,227 +220,61 @@ def generate_document(reference_choice, model_name):
         
         yield current_state()
         
-        # Generate summary for quality check
-        progress_text += "生成案件摘要以供質量檢查...\n"
-        
-        yield current_state()
-        
-        case_summary = retrieval_system.generate_case_summary(
-            query_sections_global['accident_facts'], 
-            query_sections_global['injuries']
-        )
-        progress_text += f"案件摘要:\n{case_summary}\n\n"
-        
-        yield current_state()
-        
-        # Generate facts part
-        progress_text += "生成第一部分 (事故事實)...\n"
-        
-        yield current_state()
-        
-        max_attempts = 5
-        first_part = None
-        
-        for attempt in range(1, max_attempts + 1):
-            progress_text += f"正在進行第 {attempt} 次嘗試生成事故事實...\n"
-            progress_text += f"參考案件事實陳述部分:\n{reference_parts['fact_text']}\n\n"
-            
-            yield current_state()
-            
-            first_part = retrieval_system.generate_facts(
-                query_sections_global['accident_facts'],
-                reference_parts['fact_text']
-            )
-            
-            progress_text += f"生成的事故事實:\n{first_part}\n\n"
-            first_part = retrieval_system.clean_facts_part(first_part)
-            #progress_text += f"清理後的事故事實:\n{first_part}\n"
-            
-            # Check quality
-            progress_text += "檢查生成質量...\n"
-            quality_check = retrieval_system.check_fact_quality(first_part, case_summary)
-            progress_text += f"質量檢查結果: {quality_check['result']}\n"
-            progress_text += f"原因: {quality_check['reason']}\n"
-            
-            yield current_state()
-            
-            if quality_check['result'] == 'pass':
-                progress_text += "質量檢查通過，繼續下一步\n\n"
-                break
-                
-            if attempt == max_attempts:
-                progress_text += f"警告: 達到最大嘗試次數 ({max_attempts})，使用最後一次生成的結果\n\n"
-        
-        # Generate law section
-        progress_text += "生成法條部分...\n"
-        
-        law_section = "二、按「"
-        if filtered_law_numbers:
-            # Get law contents
-            law_contents = retrieval_system.get_law_contents(filtered_law_numbers)
-            
-            for i, law in enumerate(law_contents):
-                content = law["content"]
-                if "：" in content:
-                    content = content.split("：")[1].strip()
-                elif ":" in content:
-                    content = content.split(":")[1].strip()
-                
-                if i > 0:
-                    law_section += "、「"
-                law_section += content
-                law_section += "」"
-            
-            law_section += "民法第"
-            for i, law in enumerate(law_contents):
-                if i > 0:
-                    law_section += "、第"
-                law_section += law["number"]
-                law_section += "條"
-            
-            law_section += "分別定有明文。查被告因上開侵權行為，使原告受有下列損害，依前揭規定，被告應負損害賠償責任："
-        else:
-            law_section += "NO LAW"
-        
-        progress_text += f"生成的法條部分:\n{law_section}\n\n"
-        
-        yield current_state()
-        
-        # Generate compensation part 1
-        progress_text += "生成第一部分 (損害賠償項目)...\n"
-        
-        yield current_state()
-        
-        compensation_part1 = None
-        for part1_attempt in range(1, 6):
-            progress_text += f"正在進行第 {part1_attempt} 次嘗試生成賠償項目...\n"
-            
-            yield current_state()
-            
-            compensation_part1 = retrieval_system.generate_compensation_part1(
-                query_sections_global['injuries'],
-                query_sections_global['compensation_facts'],
-                True,  # include_conclusion
-                average_compensation,
-                case_type_global,
-                plaintiffs_info_global
-            )
-            
-            progress_text += f"生成的賠償項目:\n{compensation_part1}\n\n"
-            compensation_part1 = retrieval_system.clean_compensation_part(compensation_part1)
-            #progress_text += f"清理後的賠償項目:\n{compensation_part1}\n"
-            
-            # Check quality
-            progress_text += "檢查賠償項目質量...\n"
-            quality_check = retrieval_system.check_compensation_part1(
-                compensation_part1, 
-                query_sections_global['injuries'],
-                query_sections_global['compensation_facts'],
-                plaintiffs_info_global
+        # The facts, the law checks and the compensation do not depend on each other;
+        # run them concurrently, each stage writing its own progress log
+        stage_titles = {"facts": "事故事實", "laws": "法條部分", "compensation": "賠償部分"}
+        stage_logs = {name: [] for name in stage_titles}
+
+        def stage_logger(name):
+            return lambda message: stage_logs[name].append(message + "\n")
+
+        def resolve_law_section() -> str:
+            log = stage_logger("laws")
+            final_law_numbers = check_laws(
+                retrieval_system, query_sections_global, keyword_laws, filtered_law_numbers, law_content_map, log=log
             )
-            
-            progress_text += f"質量檢查結果: {quality_check['result']}\n"
-            progress_text += f"原因: {quality_check['reason']}\n"
-            
-            yield current_state()
-            
-            if quality_check['result'] == 'pass':
-                progress_text += "質量檢查通過，繼續下一步\n\n"
-                break
-                
-            if part1_attempt == 5:
-                progress_text += "警告: 達到最大嘗試次數 (5)，使用最後一次生成的賠償項目\n\n"
-        
-        # Generate part 2 (calculation tags)
-        progress_text += "生成第二部分 (計算標籤)...\n"
-        
-        yield current_state()
-        
-        compensation_part2 = None
-        for part2_attempt in range(1, 4):
-            progress_text += f"正在進行第 {part2_attempt} 次嘗試生成計算標籤...\n"
-            
-            yield current_state()
-            
-            compensation_part2 = retrieval_system.generate_compensation_part2(compensation_part1, plaintiffs_info_global)
-            
-            progress_text += f"生成的計算標籤:\n{compensation_part2}\n"
-            
-            # Check quality
-            progress_text += "檢查計算標籤質量...\n"
-            quality_check = retrieval_system.check_calculation_tags(compensation_part1, compensation_part2)
-            progress_text += f"質量檢查結果: {quality_check['result']}\n"
-            progress_text += f"原因: {quality_check['reason']}\n"
-            
-            if quality_check['result'] == 'pass':
-                progress_text += "質量檢查通過，繼續下一步\n\n"
-                break
-                
-            if part2_attempt == 3:
-                progress_text += "警告: 達到最大嘗試次數 (3)，使用最後一次生成的計算標籤\n\n"
-        
-        # Extract and calculate sums from the tags
-        progress_text += "提取並計算賠償金額...\n"
-        
-        yield current_state()
-        
-        compensation_sums = extract_calculate_tags(compensation_part2)
-        
-        progress_text += "計算的賠償金額:\n"
-        for plaintiff, amount in compensation_sums.items():
-            if plaintiff == "default":
-                progress_text += f"總賠償金額: {amount:.2f} 元\n"
-            else:
-                progress_text += f"[原告{plaintiff}]賠償金額: {amount:.2f} 元\n"
-        
-        # Format the compensation totals for part 3
-        summary_totals = []
-        for plaintiff, amount in compensation_sums.items():
-            if plaintiff == "default":
-                summary_totals.append(f"總計{amount:.0f}元")
-            else:
-                summary_totals.append(f"應賠償[原告{plaintiff}]之損害，總計{amount:.0f}元")
-        summary_format = "；".join(summary_totals)
-        
-        # Generate part 3 (conclusion)
-        progress_text += "\n生成第三部分 (綜上所陳)...\n"
-        
-        yield current_state()
-        
-        compensation_part3 = None
-        for part3_attempt in range(1, 6):
-            progress_text += f"正在進行第 {part3_attempt} 次嘗試生成總結...\n"
-            
-            yield current_state()
-            
-            compensation_part3 = retrieval_system.generate_compensation_part3(compensation_part1, summary_format, plaintiffs_info_global)
-            
-            progress_text += f"生成的總結:\n{compensation_part3}\n\n"
-            compensation_part3 = retrieval_system.clean_conclusion_part(compensation_part3)
-            #progress_text += f"清理後的總結:\n{compensation_part3}\n"
-            conclusion_output = compensation_part3
-            
-            # Extract the part after "綜上所陳" or "綜上所述"
-            summary_section = ""
-            if "綜上所陳" in compensation_part3:
-                summary_section = compensation_part3[compensation_part3.find("綜上所陳"):]
-            elif "綜上所述" in compensation_part3:
-                summary_section = compensation_part3[compensation_part3.find("綜上所述"):]
-            
-            # Check if all amounts from compensation_sums appear in the summary section
-            progress_text += "檢查總結中是否包含所有賠償金額...\n"
-            check_result = retrieval_system.check_amounts_in_summary(summary_section, compensation_sums)
-            progress_text += f"檢查結果: {check_result['result']}\n"
-            progress_text += f"原因: {check_result['reason']}\n"
-            
-            yield current_state()
-            
-            if check_result['result'] == 'pass':
-                progress_text += "檢查通過，總結中包含所有賠償金額\n"
-                break
-            
-            if part3_attempt == 5:
-                progress_text += "警告: 達到最大嘗試次數 (5)，使用最後一次生成的總結\n"
+            law_contents = [
+                {"number": number, "content": law_content_map[number]}
+                for number in final_law_numbers if number in law_content_map
+            ]
+            section = build_law_section(law_contents)
+            log(f"\n生成的法條部分:\n{section}")
+            return section
+
+        base_progress = progress_text + "並行生成事故事實、法條與賠償部分...\n"
+        with PipelineRunner() as runner:
+            runner.submit("facts", generate_fact_part, retrieval_system, query_sections_global, reference_parts,
+                          log=stage_logger("facts"))
+            runner.submit("laws", resolve_law_section)
+            runner.submit("compensation", generate_compensation_parts, retrieval_system, query_sections_global,
+                          True, average_compensation, case_type_global, plaintiffs_info_global,
+                          log=stage_logger("compensation"))
+
+            last_snapshot = None
+            while True:
+                finished = runner.done()
+                completed = runner.completed()
+                if "facts" in completed:
+                    first_part = runner.result("facts")
+                if "laws" in completed:
+                    law_section = runner.result("laws")
+                if "compensation" in completed:
+                    compensation_part1, conclusion_output = runner.result("compensation")
+
+                # Only push an update when a stage logged something or finished
+                snapshot = tuple(len(stage_logs[name]) for name in stage_titles) + (len(completed),)
+                if snapshot != last_snapshot:
+                    last_snapshot = snapshot
+                    progress_text = base_progress + "".join(
+                        f"\n========== {title} ==========\n" + "".join(stage_logs[name])
+                        for name, title in stage_titles.items()
+                    )
+                    yield current_state()
+                if finished:
+                    break
+                runner.wait_any(timeout=1.0)
+
+        compensation_part3 = conclusion_output
         
         # Combine all parts for final output
         final_response = f"{first_part}\n\n{law_section}\n\n{compensation_part1}\n\n{compensation_part3}"
@@ -533,9 +286,6 @@ def generate_document(reference_choice, model_name):
         
         yield current_state()
         
-        # Close connections
-        retrieval_system.close()
-        
     except Exception as e:
         error_message = f"生成過程中發生錯誤: {str(e)}\n{traceback.format_exc()}"
         yield [
@@ -582,8 +332,8 @@ def load_query_from_neo4j(dropdown_value):
     # Map to Neo4j query_id (0-49)
     neo4j_query_id = case_num - 1
     
-    # Initialize retrieval system to use its Neo4j connection
-    retrieval_system = RetrievalSystem()
+    # Use the Neo4j connection of the shared retrieval system
+    retrieval_system = get_retrieval_system()
     
     # Get query text from Neo4j
     with retrieval_system.neo4j_driver.session() as session:
@@ -596,9 +346,6 @@ def load_query_from_neo4j(dropdown_value):
         record = result.single()
         query_text = record["query_text"] if record else f"未找到 ID 為 {neo4j_query_id} 的查詢"
     
-    # Close connections
-    retrieval_system.close()
-    
     return query_text
 
 # Create the Gradio interface
@@ -705,4 +452,7 @@ with gr.Blocks(title="法律文書生成系統") as demo:
 
 if __name__ == "__main__":
     demo.queue()
-    demo.launch(server_port=8899, server_name="0.0.0.0", share=True)
\ No newline at end of file
+    try:
+        demo.launch(server_port=8899, server_name="0.0.0.0", share=True)
+    finally:
+        close_retrieval_systems()
\ No newline at end of file